@@ -9,7 +9,40 @@ class TrackState(object):
     Removed = 3
 
 
+class TrackIdGenerator(object):
+    """Track ID sequence owned by one tracker, so concurrent trackers never
+    share or reset each other's IDs. IDs count up from start + 1 and are
+    returned as strings when a prefix is given.
+    """
+
+    def __init__(self, start=0, prefix=None):
+        self.start = start
+        self.prefix = prefix
+        self._count = start
+
+    def __call__(self):
+        self._count += 1
+        if self.prefix:
+            return '{}{}'.format(self.prefix, self._count)
+        return self._count
+
+    def reset(self):
+        self._count = self.start
+
+    def state(self):
+        return {'start': self.start, 'prefix': self.prefix,
+                'count': self._count}
+
+    @classmethod
+    def from_state(cls, state):
+        generator = cls(state['start'], state['prefix'])
+        generator._count = state['count']
+        return generator
+
+
 class BaseTrack(object):
+    # Process-wide counter, only used by tracks activated without an ID
+    # generator of their own
     _count = 0
 
     track_id = 0
@@ -0,0 +1,252 @@
+# Per-frame latency benchmark of the ByteTrack cores on synthetic crowded
+# scenes (hundreds of simultaneous tracks), with an output parity check
+# of each core and option against the default BYTETracker.
+# --soak instead runs each core over one long continuous scene where
+# objects keep appearing and disappearing, reporting latency and process
+# RSS per window of frames; both should stay flat.
+# Usage: python benchmark.py
+#        python benchmark.py --tracks 100 300 600 --frames 300
+#        python benchmark.py --association gated --classes 3
+#        python benchmark.py --soak 100000 --tracks 50
+#        python benchmark.py --handler --tracks 50 200
+# --handler measures whole /track requests (JSON in, tracking, JSON out)
+# through the Flask test client, next to the tracker core alone.
+# The reference ignores classes, so gated runs with --classes above 1 are
+# expected to report different IDs.
+import argparse
+import json
+import os
+import resource
+import time
+import numpy as np
+
+from yolox.tracker.byte_tracker import BYTETracker
+from soa_tracker import SoATracker
+import bytetrack_service
+from bytetrack_service import BYTETrackerArgs
+
+IMG_INFO = (1080, 1920, 3)
+CLASS_NAMES = ['person', 'car', 'bicycle', 'dog']
+
+
+def crowded_scene(n_tracks, n_frames, seed=0, n_classes=1):
+    # Per-frame (x1, y1, x2, y2, score) detections and class ids of
+    # n_tracks objects walking across a 1920x1080 frame. Objects enter and
+    # leave, miss detections, get low-score detections and come in
+    # shuffled order.
+    rng = np.random.default_rng(seed)
+    classes = rng.integers(0, n_classes, n_tracks)
+    position = rng.uniform(0, (1880, 1000), (n_tracks, 2))
+    velocity = rng.normal(0, 2, (n_tracks, 2))
+    size = rng.uniform((15, 40), (40, 100), (n_tracks, 2))
+    first_frame = rng.integers(0, n_frames // 4 + 1, n_tracks)
+    last_frame = first_frame + rng.integers(n_frames // 2, n_frames + 1,
+                                            n_tracks)
+    frames = []
+    for frame_id in range(n_frames):
+        top_left = (position + velocity * frame_id +
+                    rng.normal(0, 0.5, (n_tracks, 2)))
+        visible = ((frame_id >= first_frame) & (frame_id < last_frame) &
+                   (rng.random(n_tracks) > 0.05))
+        scores = np.where(
+            rng.random(n_tracks) > 0.15, rng.uniform(0.6, 0.95, n_tracks),
+            rng.uniform(0.15, 0.5, n_tracks))
+        detections = np.concatenate(
+            [top_left, top_left + size, scores[:, None]], axis=1)[visible]
+        order = rng.permutation(len(detections))
+        frames.append((detections[order], classes[visible][order]))
+    return frames
+
+
+def continuous_scene(n_tracks, n_frames, seed=0, n_classes=1):
+    # Generator of per-frame (detections, classes) with n_tracks objects
+    # on screen at any time, each replaced by a new object at the end of
+    # its 100-400 frame lifetime, so new track IDs never stop coming
+    rng = np.random.default_rng(seed)
+
+    def spawn(count):
+        return (rng.uniform(0, (1880, 1000), (count, 2)),
+                rng.normal(0, 2, (count, 2)),
+                rng.uniform((15, 40), (40, 100), (count, 2)),
+                rng.integers(100, 401, count),
+                rng.integers(0, n_classes, count))
+
+    position, velocity, size, lifetime, classes = spawn(n_tracks)
+    age = rng.integers(0, 100, n_tracks)
+    for _ in range(n_frames):
+        expired = age >= lifetime
+        if expired.any():
+            (position[expired], velocity[expired], size[expired],
+             lifetime[expired], classes[expired]) = spawn(expired.sum())
+            age[expired] = 0
+        top_left = (position + velocity * age[:, None] +
+                    rng.normal(0, 0.5, (n_tracks, 2)))
+        age += 1
+        visible = rng.random(n_tracks) > 0.05
+        scores = np.where(
+            rng.random(n_tracks) > 0.15, rng.uniform(0.6, 0.95, n_tracks),
+            rng.uniform(0.15, 0.5, n_tracks))
+        detections = np.concatenate(
+            [top_left, top_left + size, scores[:, None]], axis=1)[visible]
+        yield detections, classes[visible]
+
+
+def rss_mb():
+    # Current resident set size of this process
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf(
+                'SC_PAGE_SIZE') / 2**20
+    except OSError:
+        # No /proc (macOS): peak RSS, reported in bytes there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**20
+
+
+def run_tracker(tracker, frames):
+    # Returns per-frame outputs as (ids, tlwhs) and per-frame latencies
+    outputs = []
+    latencies = []
+    for detections, classes in frames:
+        detections = detections.copy()
+        start = time.perf_counter()
+        online_targets = tracker.update(detections,
+                                        IMG_INFO,
+                                        IMG_INFO,
+                                        classes=classes)
+        latencies.append(time.perf_counter() - start)
+        outputs.append(([t.track_id for t in online_targets],
+                        np.array([t.tlwh for t in online_targets])))
+    return outputs, np.array(latencies)
+
+
+def compare_outputs(baseline, candidate):
+    # Frames whose track IDs differ, and max box difference elsewhere
+    id_mismatches = 0
+    max_box_diff = 0.0
+    for (expected_ids, expected_boxes), (ids, boxes) in zip(
+            baseline, candidate):
+        if expected_ids != ids:
+            id_mismatches += 1
+        elif len(ids):
+            max_box_diff = max(max_box_diff,
+                               float(np.abs(expected_boxes - boxes).max()))
+    return id_mismatches, max_box_diff
+
+
+def format_latencies(latencies):
+    ms = latencies * 1000
+    return (f"mean {ms.mean():7.2f}ms  p50 {np.percentile(ms, 50):7.2f}ms  "
+            f"p95 {np.percentile(ms, 95):7.2f}ms")
+
+
+def benchmark(n_tracks, n_frames, seed, n_classes, tracker_args):
+    frames = crowded_scene(n_tracks, n_frames, seed, n_classes)
+    print(f"{n_tracks} objects, {n_frames} frames, "
+          f"{np.mean([len(d) for d, _ in frames]):.0f} detections/frame")
+    baseline, latencies = run_tracker(BYTETracker(BYTETrackerArgs()), frames)
+    print(f"  reference  {format_latencies(latencies)}  "
+          f"{np.mean([len(ids) for ids, _ in baseline]):.0f} tracks/frame")
+    for name, tracker_class in (('strack', BYTETracker), ('soa', SoATracker)):
+        outputs, core_latencies = run_tracker(tracker_class(tracker_args),
+                                              frames)
+        id_mismatches, box_diff = compare_outputs(baseline, outputs)
+        print(f"  {name:<9}  {format_latencies(core_latencies)}  "
+              f"speedup {latencies.mean() / core_latencies.mean():.2f}x, "
+              f"frames with different IDs: {id_mismatches}, "
+              f"max box diff: {box_diff:.2e}px")
+
+
+def soak(n_tracks, n_frames, seed, n_classes, tracker_args, window=10000):
+    print(f"Soak: {n_tracks} objects on screen, {n_frames} frames")
+    for name, tracker_class in (('strack', BYTETracker), ('soa', SoATracker)):
+        tracker = tracker_class(tracker_args)
+        latencies = []
+        for frame_id, (detections, classes) in enumerate(
+                continuous_scene(n_tracks, n_frames, seed, n_classes), 1):
+            start = time.perf_counter()
+            tracker.update(detections, IMG_INFO, IMG_INFO, classes=classes)
+            latencies.append(time.perf_counter() - start)
+            if frame_id % window == 0 or frame_id == n_frames:
+                print(f"  {name:<9}  frames {frame_id:>7}  "
+                      f"{format_latencies(np.array(latencies))}  "
+                      f"RSS {rss_mb():7.1f}MB  "
+                      f"active tracks {len(tracker.active_track_ids())}")
+                latencies = []
+
+
+def track_payload(frames):
+    # /track request body (YOLO's per-frame records) for frames
+    return [{
+        'request_id': 'benchmark',
+        'frame_id': frame_id,
+        'timestamp': round(frame_id / 25, 2),
+        'shape': ','.join(map(str, IMG_INFO)),
+        'box': detections[:, :4].tolist(),
+        'confidence': detections[:, 4].tolist(),
+        'class_id': classes.astype(float).tolist(),
+        'class_name': [CLASS_NAMES[c % len(CLASS_NAMES)] for c in classes],
+    } for frame_id, (detections, classes) in enumerate(frames)]
+
+
+def benchmark_handler(n_tracks, n_frames, seed, n_classes, repeats=3):
+    frames = crowded_scene(n_tracks, n_frames, seed, n_classes)
+    body = json.dumps(track_payload(frames))
+    _, latencies = run_tracker(
+        bytetrack_service.BYTETracker(BYTETrackerArgs()), frames)
+    client = bytetrack_service.app.test_client()
+    elapsed = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        response = client.post('/track',
+                               data=body,
+                               content_type='application/json')
+        elapsed.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise SystemExit(f"/track failed: {response.get_data()}")
+    handler_seconds = min(elapsed)
+    print(f"{n_tracks} objects, {n_frames} frames: "
+          f"/track {n_frames / handler_seconds:8.1f} frames/sec, "
+          f"tracker alone {n_frames / latencies.sum():8.1f} frames/sec, "
+          f"handler overhead "
+          f"{(handler_seconds - latencies.sum()) / n_frames * 1000:.2f}"
+          f"ms/frame, response {len(response.get_data()) / 2**20:.1f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tracks',
+                        type=int,
+                        nargs='+',
+                        default=[100, 300, 600])
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--classes', type=int, default=1)
+    parser.add_argument('--kalman-float32', action='store_true')
+    parser.add_argument('--association',
+                        choices=['dense', 'gated'],
+                        default='dense')
+    parser.add_argument('--gate-margin', type=float, default=0.)
+    parser.add_argument('--soak', type=int, metavar='FRAMES')
+    parser.add_argument('--handler', action='store_true')
+    args = parser.parse_args()
+
+    # Options under test; the reference run always uses the defaults
+    tracker_args = BYTETrackerArgs()
+    tracker_args.kalman_float32 = args.kalman_float32
+    tracker_args.association = args.association
+    tracker_args.gate_margin = args.gate_margin
+    if args.handler:
+        # The handler runs the service's own tracker configuration
+        bytetrack_service.load_tracker()
+    for n_tracks in args.tracks:
+        if args.handler:
+            benchmark_handler(n_tracks, args.frames, args.seed, args.classes)
+        elif args.soak:
+            soak(n_tracks, args.soak, args.seed, args.classes, tracker_args)
+        else:
+            benchmark(n_tracks, args.frames, args.seed, args.classes,
+                      tracker_args)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,16 +3,51 @@ from collections import deque
 import os
 import os.path as osp
 import copy
-import torch
-import torch.nn.functional as F
 
 from .kalman_filter import KalmanFilter
 from yolox.tracker import matching
-from .basetrack import BaseTrack, TrackState
+from .basetrack import BaseTrack, TrackIdGenerator, TrackState
+from .gated_matching import gated_assignment
+
+
+class BatchKalmanFilter(KalmanFilter):
+    def multi_update(self, mean, covariance, measurement, dtype=np.float64):
+        """Run the Kalman filter correction step for N tracks at once
+        (vectorized version of update()), as one batched solve.
+        :param mean: Nx8 predicted state means
+        :param covariance: Nx8x8 predicted state covariances
+        :param measurement: Nx4 measurements (x, y, a, h)
+        :param dtype: precision of the computation; np.float32 is faster
+            at a small accuracy cost. Results keep the dtype of mean.
+        :return: corrected (mean, covariance)
+        """
+        out_dtype = mean.dtype
+        mean = mean.astype(dtype, copy=False)
+        covariance = covariance.astype(dtype, copy=False)
+        measurement = np.asarray(measurement, dtype=dtype)
+
+        # Batched project(); the update matrix selects the first 4 states
+        std = self._std_weight_position * mean[:, 3]
+        innovation_var = np.square(np.stack(
+            [std, std, np.full_like(std, 1e-1), std], axis=1))
+        projected_mean = mean[:, :4]
+        projected_cov = covariance[:, :4, :4].copy()
+        projected_cov[:, np.arange(4), np.arange(4)] += innovation_var
+
+        # Kalman gain K = P H^T S^-1, solved as S K^T = H P
+        kalman_gain = np.linalg.solve(
+            projected_cov, covariance[:, :4, :]).transpose(0, 2, 1)
+        innovation = measurement - projected_mean
+        new_mean = mean + np.matmul(kalman_gain, innovation[:, :, None])[:, :, 0]
+        new_covariance = covariance - np.matmul(
+            np.matmul(kalman_gain, projected_cov), kalman_gain.transpose(0, 2, 1))
+        return new_mean.astype(out_dtype, copy=False), \
+            new_covariance.astype(out_dtype, copy=False)
+
 
 class STrack(BaseTrack):
-    shared_kalman = KalmanFilter()
-    def __init__(self, tlwh, score):
+    shared_kalman = BatchKalmanFilter()
+    def __init__(self, tlwh, score, cls=0, det_index=-1):
 
         # wait activate
         self._tlwh = np.asarray(tlwh, dtype=np.float)
@@ -21,6 +56,10 @@ class STrack(BaseTrack):
         self.is_activated = False
 
         self.score = score
+        self.cls = cls
+        # Row of update()'s output_results this track last matched, -1
+        # when it was not matched in the current frame
+        self.det_index = det_index
         self.tracklet_len = 0
 
     def predict(self):
@@ -42,10 +81,36 @@ class STrack(BaseTrack):
                 stracks[i].mean = mean
                 stracks[i].covariance = cov
 
-    def activate(self, kalman_filter, frame_id):
+    @staticmethod
+    def multi_update(stracks, detections, frame_id, dtype=np.float64):
+        """Match each track in stracks to the detection at the same index:
+        one batched Kalman correction for all of them, then the bookkeeping
+        of update() for tracked tracks or re_activate() for lost ones.
+        """
+        if len(stracks) > 0:
+            multi_mean = np.asarray([st.mean for st in stracks])
+            multi_covariance = np.asarray([st.covariance for st in stracks])
+            measurement = np.asarray(
+                [STrack.tlwh_to_xyah(det.tlwh) for det in detections])
+            multi_mean, multi_covariance = STrack.shared_kalman.multi_update(
+                multi_mean, multi_covariance, measurement, dtype=dtype)
+            for st, det, mean, cov in zip(stracks, detections, multi_mean,
+                                          multi_covariance):
+                st.mean, st.covariance = mean, cov
+                if st.state == TrackState.Tracked:
+                    st.tracklet_len += 1
+                else:
+                    st.tracklet_len = 0
+                st.state = TrackState.Tracked
+                st.is_activated = True
+                st.frame_id = frame_id
+                st.score = det.score
+                st.det_index = det.det_index
+
+    def activate(self, kalman_filter, frame_id, next_id=None):
         """Start a new tracklet"""
         self.kalman_filter = kalman_filter
-        self.track_id = self.next_id()
+        self.track_id = (next_id or self.next_id)()
         self.mean, self.covariance = self.kalman_filter.initiate(self.tlwh_to_xyah(self._tlwh))
 
         self.tracklet_len = 0
@@ -56,7 +121,7 @@ class STrack(BaseTrack):
         self.frame_id = frame_id
         self.start_frame = frame_id
 
-    def re_activate(self, new_track, frame_id, new_id=False):
+    def re_activate(self, new_track, frame_id, new_id=False, next_id=None):
         self.mean, self.covariance = self.kalman_filter.update(
             self.mean, self.covariance, self.tlwh_to_xyah(new_track.tlwh)
         )
@@ -65,8 +130,9 @@ class STrack(BaseTrack):
         self.is_activated = True
         self.frame_id = frame_id
         if new_id:
-            self.track_id = self.next_id()
+            self.track_id = (next_id or self.next_id)()
         self.score = new_track.score
+        self.det_index = new_track.det_index
 
     def update(self, new_track, frame_id):
         """
@@ -86,6 +152,7 @@ class STrack(BaseTrack):
         self.is_activated = True
 
         self.score = new_track.score
+        self.det_index = new_track.det_index
 
     @property
     # @jit(nopython=True)
@@ -138,17 +205,55 @@ class STrack(BaseTrack):
         ret[2:] += ret[:2]
         return ret
 
+    def export_state(self):
+        """Track state as a JSON-serializable dict (see BYTETracker.export_state)"""
+        return {
+            'track_id': self.track_id,
+            'state': int(self.state),
+            'is_activated': bool(self.is_activated),
+            'mean': [float(v) for v in self.mean],
+            'covariance': [[float(v) for v in row] for row in self.covariance],
+            'score': float(self.score),
+            'class_id': float(self.cls),
+            'tracklet_len': int(self.tracklet_len),
+            'start_frame': int(self.start_frame),
+            'frame_id': int(self.frame_id),
+        }
+
+    @staticmethod
+    def from_state(track_state, kalman_filter):
+        """Rebuild a track exported by export_state()"""
+        mean = np.asarray(track_state['mean'], dtype=np.float64)
+        tlwh = mean[:4].copy()
+        tlwh[2] *= tlwh[3]
+        tlwh[:2] -= tlwh[2:] / 2
+        track = STrack(tlwh, track_state['score'], track_state['class_id'])
+        track.kalman_filter = kalman_filter
+        track.mean = mean
+        track.covariance = np.asarray(track_state['covariance'], dtype=np.float64)
+        track.track_id = track_state['track_id']
+        track.state = track_state['state']
+        track.is_activated = track_state['is_activated']
+        track.tracklet_len = track_state['tracklet_len']
+        track.start_frame = track_state['start_frame']
+        track.frame_id = track_state['frame_id']
+        return track
+
     def __repr__(self):
         return 'OT_{}_({}-{})'.format(self.track_id, self.start_frame, self.end_frame)
 
 
 class BYTETracker(object):
-    def __init__(self, args, frame_rate=30):
-        print("xxxXXXXXxxxxxxx")
-        BaseTrack.reset_ids() # this line is added
+    def __init__(self, args, frame_rate=30, id_generator=None):
+        # Each tracker numbers its own tracks (from 1 unless id_generator
+        # says otherwise), independent of any other tracker in the process
+        self.id_generator = id_generator or TrackIdGenerator()
         self.tracked_stracks = []  # type: list[STrack]
         self.lost_stracks = []  # type: list[STrack]
-        self.removed_stracks = []  # type: list[STrack]
+        # IDs of removed tracks that are still in tracked_stracks or
+        # lost_stracks. Tracks leave both lists for good, so IDs expire
+        # with them and the set stays bounded however long the tracker runs.
+        self.removed_ids = set()
 
         self.frame_id = 0
         self.args = args
@@ -157,8 +262,37 @@ class BYTETracker(object):
         self.buffer_size = int(frame_rate / 30.0 * args.track_buffer)
         self.max_time_lost = self.buffer_size
         self.kalman_filter = KalmanFilter()
+        # Precision of the batched Kalman correction in update()
+        self.kalman_dtype = (np.float32 if getattr(args, 'kalman_float32', False)
+                             else np.float64)
+        # 'dense' matches on full tracks x detections IoU matrices, 'gated'
+        # only within each class and between boxes overlapping after growing
+        # them by gate_margin pixels (see gated_matching.py)
+        self.association = getattr(args, 'association', 'dense')
+        self.gate_margin = getattr(args, 'gate_margin', 0.)
+
+    def associate(self, stracks, detections, thresh, fuse=True):
+        """IoU assignment of stracks to detections, fusing detection scores
+        into the cost when fuse is set (and not mot20)
+        """
+        fuse = fuse and not self.args.mot20
+        if self.association == 'gated':
+            return gated_assignment(
+                [track.tlbr for track in stracks], [det.tlbr for det in detections], thresh,
+                aclasses=[track.cls for track in stracks],
+                bclasses=[det.cls for det in detections],
+                bscores=[det.score for det in detections] if fuse else None,
+                margin=self.gate_margin)
+        dists = matching.iou_distance(stracks, detections)
+        if fuse:
+            dists = matching.fuse_score(dists, detections)
+        return matching.linear_assignment(dists, thresh=thresh)
 
-    def update(self, output_results, img_info, img_size):
+    def update(self, output_results, img_info, img_size, classes=None):
+        """classes: optional class id per row of output_results; with the
+        gated association, tracks only match detections of their own class.
+        Each returned track's det_index is the output_results row it matched.
+        """
         self.frame_id += 1
         activated_starcks = []
         refind_stracks = []
@@ -175,6 +309,9 @@ class BYTETracker(object):
         img_h, img_w = img_info[0], img_info[1]
         scale = min(img_size[0] / float(img_h), img_size[1] / float(img_w))
         bboxes /= scale
+        if classes is None:
+            classes = np.zeros(len(scores))
+        classes = np.asarray(classes)
 
         remain_inds = scores > self.args.track_thresh
         inds_low = scores > 0.1
@@ -185,11 +322,15 @@ class BYTETracker(object):
         dets = bboxes[remain_inds]
         scores_keep = scores[remain_inds]
         scores_second = scores[inds_second]
+        classes_keep = classes[remain_inds]
+        classes_second = classes[inds_second]
+        det_indices_keep = np.flatnonzero(remain_inds)
+        det_indices_second = np.flatnonzero(inds_second)
 
         if len(dets) > 0:
             '''Detections'''
-            detections = [STrack(STrack.tlbr_to_tlwh(tlbr), s) for
-                          (tlbr, s) in zip(dets, scores_keep)]
+            detections = [STrack(STrack.tlbr_to_tlwh(tlbr), s, c, i) for
+                          (tlbr, s, c, i) in zip(dets, scores_keep, classes_keep, det_indices_keep)]
         else:
             detections = []
 
@@ -206,41 +347,37 @@ class BYTETracker(object):
         strack_pool = joint_stracks(tracked_stracks, self.lost_stracks)
         # Predict the current location with KF
         STrack.multi_predict(strack_pool)
-        dists = matching.iou_distance(strack_pool, detections)
-        if not self.args.mot20:
-            dists = matching.fuse_score(dists, detections)
-        matches, u_track, u_detection = matching.linear_assignment(dists, thresh=self.args.match_thresh)
+        matches, u_track, u_detection = self.associate(strack_pool, detections, self.args.match_thresh)
 
-        for itracked, idet in matches:
-            track = strack_pool[itracked]
-            det = detections[idet]
+        matched_stracks = [strack_pool[itracked] for itracked, _ in matches]
+        for track in matched_stracks:
             if track.state == TrackState.Tracked:
-                track.update(detections[idet], self.frame_id)
                 activated_starcks.append(track)
             else:
-                track.re_activate(det, self.frame_id, new_id=False)
                 refind_stracks.append(track)
+        STrack.multi_update(matched_stracks, [detections[idet] for _, idet in matches],
+                            self.frame_id, dtype=self.kalman_dtype)
 
         ''' Step 3: Second association, with low score detection boxes'''
         # association the untrack to the low score detections
         if len(dets_second) > 0:
             '''Detections'''
-            detections_second = [STrack(STrack.tlbr_to_tlwh(tlbr), s) for
-                          (tlbr, s) in zip(dets_second, scores_second)]
+            detections_second = [STrack(STrack.tlbr_to_tlwh(tlbr), s, c, i) for
+                          (tlbr, s, c, i) in zip(dets_second, scores_second, classes_second,
+                                                 det_indices_second)]
         else:
             detections_second = []
         r_tracked_stracks = [strack_pool[i] for i in u_track if strack_pool[i].state == TrackState.Tracked]
-        dists = matching.iou_distance(r_tracked_stracks, detections_second)
-        matches, u_track, u_detection_second = matching.linear_assignment(dists, thresh=0.5)
-        for itracked, idet in matches:
-            track = r_tracked_stracks[itracked]
-            det = detections_second[idet]
+        matches, u_track, u_detection_second = self.associate(
+            r_tracked_stracks, detections_second, 0.5, fuse=False)
+        matched_stracks = [r_tracked_stracks[itracked] for itracked, _ in matches]
+        for track in matched_stracks:
             if track.state == TrackState.Tracked:
-                track.update(det, self.frame_id)
                 activated_starcks.append(track)
             else:
-                track.re_activate(det, self.frame_id, new_id=False)
                 refind_stracks.append(track)
+        STrack.multi_update(matched_stracks, [detections_second[idet] for _, idet in matches],
+                            self.frame_id, dtype=self.kalman_dtype)
 
         for it in u_track:
             track = r_tracked_stracks[it]
@@ -250,10 +387,7 @@ class BYTETracker(object):
 
         '''Deal with unconfirmed tracks, usually tracks with only one beginning frame'''
         detections = [detections[i] for i in u_detection]
-        dists = matching.iou_distance(unconfirmed, detections)
-        if not self.args.mot20:
-            dists = matching.fuse_score(dists, detections)
-        matches, u_unconfirmed, u_detection = matching.linear_assignment(dists, thresh=0.7)
+        matches, u_unconfirmed, u_detection = self.associate(unconfirmed, detections, 0.7)
         for itracked, idet in matches:
             unconfirmed[itracked].update(detections[idet], self.frame_id)
             activated_starcks.append(unconfirmed[itracked])
@@ -267,7 +401,7 @@ class BYTETracker(object):
             track = detections[inew]
             if track.score < self.det_thresh:
                 continue
-            track.activate(self.kalman_filter, self.frame_id)
+            track.activate(self.kalman_filter, self.frame_id, self.id_generator)
             activated_starcks.append(track)
         """ Step 5: Update state"""
         for track in self.lost_stracks:
@@ -282,14 +416,61 @@ class BYTETracker(object):
         self.tracked_stracks = joint_stracks(self.tracked_stracks, refind_stracks)
         self.lost_stracks = sub_stracks(self.lost_stracks, self.tracked_stracks)
         self.lost_stracks.extend(lost_stracks)
-        self.lost_stracks = sub_stracks(self.lost_stracks, self.removed_stracks)
-        self.removed_stracks.extend(removed_stracks)
+        self.lost_stracks = [t for t in self.lost_stracks if t.track_id not in self.removed_ids]
+        self.removed_ids.update(t.track_id for t in removed_stracks)
         self.tracked_stracks, self.lost_stracks = remove_duplicate_stracks(self.tracked_stracks, self.lost_stracks)
+        self.removed_ids.intersection_update(
+            [t.track_id for t in self.tracked_stracks] + [t.track_id for t in self.lost_stracks])
         # get scores of lost tracks
         output_stracks = [track for track in self.tracked_stracks if track.is_activated]
 
         return output_stracks
 
+    def active_track_ids(self):
+        """IDs of the tracked and lost tracks, the only ones that can still
+        appear in an output
+        """
+        return [t.track_id for t in self.tracked_stracks + self.lost_stracks]
+
+    def export_state(self):
+        """Compact, JSON-serializable snapshot of the tracker: frame counter,
+        track ID sequence and the tracked and lost tracks with their Kalman
+        state. Of the removed tracks only the IDs still in those lists are
+        kept, the only ones that affect later frames.
+        """
+        return {
+            'frame_id': self.frame_id,
+            'ids': self.id_generator.state(),
+            'tracks': [track.export_state()
+                       for track in self.tracked_stracks + self.lost_stracks],
+            'removed_ids': list(self.removed_ids),
+        }
+
+    def import_state(self, snapshot):
+        """Continue from a snapshot made by export_state() (of either
+        tracker core), replacing the current tracks
+        """
+        self.frame_id = snapshot['frame_id']
+        self.id_generator = TrackIdGenerator.from_state(snapshot['ids'])
+        tracks = [STrack.from_state(track_state, self.kalman_filter)
+                  for track_state in snapshot['tracks']]
+        # Tracks expired this frame stay in lost_stracks until the next one
+        self.tracked_stracks = [t for t in tracks if t.state == TrackState.Tracked]
+        self.lost_stracks = [t for t in tracks if t.state != TrackState.Tracked]
+        self.removed_ids = set(snapshot.get('removed_ids', []))
+
+    def predict_only(self):
+        """Advance one frame without detections (e.g. a frame skipped by the
+        detector): tracked and lost tracks move to their Kalman-predicted
+        position, no association or track creation/removal happens.
+        """
+        self.frame_id += 1
+        strack_pool = joint_stracks(self.tracked_stracks, self.lost_stracks)
+        STrack.multi_predict(strack_pool)
+        for track in strack_pool:
+            track.det_index = -1
+        return [track for track in self.tracked_stracks if track.is_activated]
+
 
 def joint_stracks(tlista, tlistb):
     exists = {}
@@ -1,9 +1,14 @@
 import flask
-from yolox.tracker.byte_tracker import BYTETracker
-from yolox.tracker.basetrack import BaseTrack
+import msgpack
 import numpy as np
 import logging
+import os
 import sys
+import threading
+import time
+
+from track_io import DetectionPayload, FrameError, TrackResults, dumps
+from tracking_sessions import SessionStore
 
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s',
@@ -19,6 +24,89 @@ class BYTETrackerArgs:
     mot20: bool = False
     aspect_ratio_thresh = 10.0
     min_box_area = 1.0
+    # 'dense' or 'gated' (class-partitioned, spatially gated) association
+    association: str = os.environ.get('ASSOCIATION', 'dense')
+    gate_margin: float = float(os.environ.get('GATE_MARGIN', 0))
+    # Batched Kalman correction in float32 instead of float64
+    kalman_float32: bool = os.environ.get('KALMAN_FLOAT32',
+                                          'false').lower() == 'true'
+
+
+# Tracker implementation: 'strack' is YOLOX's BYTETracker (one STrack
+# object per track), 'soa' the structure-of-arrays core in soa_tracker.py
+# with the same outputs and vectorized per-frame updates
+TRACKER_CORE = os.environ.get('TRACKER_CORE', 'strack')
+# How long /track waits for the tracker to finish loading
+TRACKER_READY_TIMEOUT = float(os.environ.get('TRACKER_READY_TIMEOUT', 300))
+# Streaming sessions (/sessions) unused for SESSION_IDLE_TIMEOUT seconds
+# are evicted; at most MAX_SESSIONS are open at once
+SESSION_IDLE_TIMEOUT = float(os.environ.get('SESSION_IDLE_TIMEOUT', 600))
+MAX_SESSIONS = int(os.environ.get('MAX_SESSIONS', 100))
+# Frames between clean-ups of the per-track class cache within a request
+TRACK_CLASSES_PRUNE_INTERVAL = 1000
+# Layouts of tracking results, see track_io
+RESULTS_FORMATS = ('frames', 'tracklets')
+# Content type of columnar MessagePack requests and responses, see track_io
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+# yolox pulls in torch, so it is imported by load_tracker() in the
+# background rather than at module import
+BYTETracker = None
+BaseTrack = None
+TrackIdGenerator = None
+tracker_ready = threading.Event()
+tracker_error = None
+sessions = SessionStore(SESSION_IDLE_TIMEOUT, MAX_SESSIONS)
+
+
+def load_tracker():
+    # Import the YOLOX tracker and run a warmup update, logging each
+    # startup phase
+    global BYTETracker, BaseTrack, TrackIdGenerator, tracker_error
+    try:
+        phase_start = startup_start = time.perf_counter()
+        if TRACKER_CORE == 'soa':
+            from soa_tracker import SoATracker as tracker_class
+        elif TRACKER_CORE == 'strack':
+            from yolox.tracker.byte_tracker import BYTETracker as tracker_class
+        else:
+            raise ValueError(f"Unsupported TRACKER_CORE: {TRACKER_CORE}")
+        from yolox.tracker.basetrack import BaseTrack as base_track_class
+        from yolox.tracker.basetrack import TrackIdGenerator as id_class
+        import_seconds = time.perf_counter() - phase_start
+
+        phase_start = time.perf_counter()
+        warmup_tracker = tracker_class(BYTETrackerArgs())
+        warmup_detections = np.array([[0, 0, 10, 10, 0.9]])
+        for _ in range(2):
+            warmup_tracker.update(warmup_detections, (64, 64, 3),
+                                  (64, 64, 3))
+        warmup_seconds = time.perf_counter() - phase_start
+
+        BYTETracker, BaseTrack = tracker_class, base_track_class
+        TrackIdGenerator = id_class
+        tracker_ready.set()
+        logger.info(f"ByteTrack ({TRACKER_CORE}) ready in "
+                    f"{time.perf_counter() - startup_start:.2f}s: "
+                    f"import {import_seconds:.2f}s, "
+                    f"warmup {warmup_seconds:.2f}s")
+    except Exception as e:
+        tracker_error = str(e)
+        logger.error(f"Failed to load ByteTrack: {str(e)}", exc_info=True)
+
+
+def load_tracker_in_background():
+    threading.Thread(target=load_tracker, daemon=True).start()
+
+
+def tracker_not_ready_response():
+    # 503 response if the tracker is not ready in time, otherwise None
+    if tracker_ready.wait(timeout=TRACKER_READY_TIMEOUT):
+        return None
+    return flask.jsonify({
+        'error':
+        f'ByteTrack is not ready: {tracker_error or "still loading"}'
+    }), 503
 
 
 app = flask.Flask(__name__)
@@ -30,8 +118,50 @@ def home():
     return "ByteTrack service is running", 200
 
 
+@app.route('/ready')
+def ready():
+    # Readiness probe: healthy only once the tracker has been warmed up
+    if tracker_ready.is_set():
+        return "ByteTrack is ready", 200
+    if tracker_error:
+        return f"ByteTrack failed to load: {tracker_error}", 503
+    return "ByteTrack is loading", 503
+
+
+def parse_id_options(args):
+    # Optional per-segment track ID namespace from /track query params:
+    # id_start (first ID is id_start + 1) and id_prefix (IDs become
+    # '<id_prefix><n>' strings)
+    id_start = int(args.get('id_start', 0))
+    if id_start < 0:
+        raise ValueError('id_start must be a non-negative integer')
+    return {'start': id_start, 'prefix': args.get('id_prefix') or None}
+
+
+def parse_results_format(args):
+    # ?format= of tracking results: 'frames' (one record per track per
+    # frame, the default) or 'tracklets' (one record per track ID)
+    results_format = args.get('format', 'frames').lower()
+    if results_format not in RESULTS_FORMATS:
+        raise ValueError(
+            f"format must be one of {', '.join(RESULTS_FORMATS)}")
+    return results_format
+
+
+def serialize_results(tracking_results, results_format):
+    if results_format == 'tracklets':
+        return dumps(tracking_results.to_tracklets())
+    return tracking_results.to_json()
+
+
+# Kept for existing callers: every tracker now owns its ID generator, so
+# this only resets the process-wide fallback counter
 @app.route('/reset_ids', methods=['POST'])
 def reset_ids():
+    not_ready = tracker_not_ready_response()
+    if not_ready:
+        return not_ready
+
     try:
         # Log the current ID before reset
         current_id = BaseTrack._count
@@ -62,215 +192,327 @@ def reset_ids():
             {'error': f'Failed to reset tracking IDs: {str(e)}'}), 500
 
 
+class TrackingError(Exception):
+    pass
+
+
+def export_snapshot(tracker, track_classes):
+    # Tracker state snapshot plus the last class of each of its tracks,
+    # which only the service knows by name
+    snapshot = tracker.export_state()
+    track_ids = {track['track_id'] for track in snapshot['tracks']}
+    snapshot['track_classes'] = [[tid, *track_classes[tid]]
+                                 for tid in track_ids
+                                 if tid in track_classes]
+    return snapshot
+
+
+def import_snapshot(tracker, snapshot):
+    # Restores an export_snapshot() into tracker; returns its track_classes
+    tracker.import_state(snapshot)
+    return {
+        tid: (class_id, class_name)
+        for tid, class_id, class_name in snapshot.get('track_classes', [])
+    }
+
+
+def track_frame(tracker, track_classes, payload, i, results):
+    # Tracks frame i of a DetectionPayload and adds its records to results.
+    # track_classes maps each track ID to its last (class_id, class_name)
+    # and is updated in place
+    # Frames with missing required data or no detections: skip ByteTrack
+    # processing but keep each frame for record with null info
+    if payload.placeholder[i]:
+        results.add_placeholder(i)
+        return
+
+    # Frames skipped by YOLO (frame_stride) carry no detections; the
+    # tracker coasts its tracks on Kalman prediction instead
+    predicted = payload.predicted[i]
+    detections, class_ids, class_names = payload.frame(i)
+    try:
+        if predicted:
+            online_targets = tracker.predict_only()
+        else:
+            online_targets = tracker.update(detections,
+                                            payload.shapes[i],
+                                            payload.shapes[i],
+                                            classes=class_ids)
+    except Exception as e:
+        raise RuntimeError(f"ByteTrack update failed for frame "
+                           f"{payload.frame_ids[i]}, {detections}: {str(e)}")
+    # Keep frames where Bytetrack returns no tracks for record too
+    if not online_targets:
+        results.add_placeholder(i)
+        return
+
+    # Drop tiny and overly wide boxes. Reference:
+    # https://github.com/ifzhang/ByteTrack/blob/d1bf0191adff59bc8fcfeaa0b33d3d1642552a99/tools/demo_track.py#L188
+    tlwhs = np.array([t.tlwh for t in online_targets])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vertical = tlwhs[:, 2] / tlwhs[:, 3] > BYTETrackerArgs.aspect_ratio_thresh
+    keep = (tlwhs[:, 2] * tlwhs[:, 3] > BYTETrackerArgs.min_box_area) & ~vertical
+    targets = [t for t, kept in zip(online_targets, keep) if kept]
+    tlwhs = tlwhs[keep]
+    boxes = tlwhs.copy()
+    boxes[:, 2:] += boxes[:, :2]
+    track_ids = [t.track_id for t in targets]
+    confidences = [round(float(t.score), 2) for t in targets]
+
+    if predicted:
+        track_class_ids, track_class_names = [], []
+        for tid in track_ids:
+            class_id, class_name = track_classes.get(tid, (None, None))
+            track_class_ids.append(class_id)
+            track_class_names.append(class_name)
+    else:
+        # Each track carries the row of the detection it matched
+        det_index = np.array([t.det_index for t in targets], dtype=np.int64)
+        track_class_ids = class_ids[det_index].astype(np.int64).tolist()
+        track_class_names = class_names[det_index].tolist()
+        track_classes.update(
+            zip(track_ids, zip(track_class_ids, track_class_names)))
+
+    results.add_tracks(i, track_ids, boxes.astype(np.int64), confidences,
+                       track_class_ids, track_class_names, predicted)
+
+
+def prune_track_classes(tracker, track_classes):
+    # Forget classes of tracks the tracker has dropped, so long segments
+    # and sessions do not accumulate one entry per track ever seen
+    active_ids = set(tracker.active_track_ids())
+    for tid in [tid for tid in track_classes if tid not in active_ids]:
+        del track_classes[tid]
+
+
+def is_columnar(detection_results):
+    # Whether a request body holds frames in YOLO's columnar format
+    return (isinstance(detection_results, dict)
+            and detection_results.get('format') == 'columns')
+
+
+def track_frames(tracker, track_classes, detection_results):
+    # TrackResults for a list of detection frames (or YOLO's columnar
+    # detections), tracked in order; raises TrackingError naming the frame
+    # that failed
+    try:
+        if is_columnar(detection_results):
+            payload = DetectionPayload.from_columns(detection_results)
+        else:
+            payload = DetectionPayload(detection_results)
+    except FrameError as e:
+        if e.frame_id is None:
+            raise TrackingError(f"Unexpected error reading frames: {str(e)}")
+        raise TrackingError(
+            f"Unexpected error processing frame {e.frame_id}: {str(e)}")
+    except Exception as e:
+        raise TrackingError(f"Unexpected error reading frames: {str(e)}")
+
+    results = TrackResults(payload)
+    for i in range(len(payload)):
+        if (i + 1) % TRACK_CLASSES_PRUNE_INTERVAL == 0:
+            prune_track_classes(tracker, track_classes)
+        try:
+            track_frame(tracker, track_classes, payload, i, results)
+        except RuntimeError as e:
+            raise TrackingError(f"ByteTrack processing error: {str(e)}")
+        except Exception as e:
+            raise TrackingError(f"Unexpected error processing frame "
+                                f"{payload.frame_ids[i]}: {str(e)}")
+    prune_track_classes(tracker, track_classes)
+    return results
+
+
+def json_response(body):
+    # Response for a JSON body that is already serialized
+    return flask.Response(body, mimetype='application/json')
+
+
+def read_request_body():
+    # Request body as JSON, or unpacked from MessagePack when sent as such;
+    # None if it cannot be read
+    if flask.request.mimetype == MSGPACK_MIMETYPE:
+        try:
+            return msgpack.unpackb(flask.request.get_data())
+        except Exception:
+            return None
+    return flask.request.get_json(silent=True)
+
+
+def results_response(tracking_results, results_format, snapshot=None):
+    # Tracking results in results_format, with the tracker snapshot
+    # alongside when given, as MessagePack for clients that accept it
+    if flask.request.headers.get('Accept') == MSGPACK_MIMETYPE:
+        if results_format == 'tracklets':
+            results = tracking_results.to_tracklets()
+        else:
+            results = tracking_results.to_columns()
+        if snapshot is not None:
+            results = {'results': results, 'snapshot': snapshot}
+        return flask.Response(msgpack.packb(results),
+                              mimetype=MSGPACK_MIMETYPE)
+    results = serialize_results(tracking_results, results_format)
+    if snapshot is not None:
+        results = '{"results":%s,"snapshot":%s}' % (results, dumps(snapshot))
+    return json_response(results)
+
+
 # Main tracking processing endpoint
 @app.route('/track', methods=['POST'])
 def track():
+    not_ready = tracker_not_ready_response()
+    if not_ready:
+        return not_ready
+
     try:
-        # Get request's JSON data from main tracking-service
-        detection_results = flask.request.get_json()
-        tracking_results = []
+        # Get request's JSON data from main tracking-service: the list of
+        # detection frames, or {'frames': [...], 'snapshot': {...}} to
+        # continue from an earlier segment's tracker state. MessagePack
+        # requests carry the frames in YOLO's columnar format instead.
+        detection_results = read_request_body()
+        snapshot = None
+        if isinstance(detection_results,
+                      dict) and not is_columnar(detection_results):
+            snapshot = detection_results.get('snapshot')
+            detection_results = detection_results.get('frames')
 
         if not detection_results:
             return flask.jsonify({'error': 'No detections provided'}), 400
 
-        current_id = BaseTrack._count
-        logger.info(f"Current Byetracker tracker ID: {current_id} from")
-        sys.stdout.flush()
-
-        # Initialize Bytetrack instance
-        tracker = BYTETracker(BYTETrackerArgs())
+        try:
+            id_options = parse_id_options(flask.request.args)
+        except ValueError as e:
+            return flask.jsonify({'error': f'Invalid ID options: {str(e)}'
+                                  }), 400
+        try:
+            results_format = parse_results_format(flask.request.args)
+        except ValueError as e:
+            return flask.jsonify({'error': str(e)}), 400
 
-        # Process each frame in detection results
-        for frame_result in detection_results:
+        # Initialize Bytetrack instance with its own track ID sequence, so
+        # concurrent requests never interfere with each other's IDs
+        tracker = BYTETracker(BYTETrackerArgs(),
+                              id_generator=TrackIdGenerator(**id_options))
+        track_classes = {}
+        if snapshot:
             try:
-                # Extract each frame's info
-                request_id = frame_result.get('request_id')
-                frame_id = frame_result.get('frame_id')
-                timestamp = frame_result.get('timestamp')
-                boxes = frame_result.get('box')
-                scores = frame_result.get('confidence')
-                class_id = frame_result.get('class_id')
-                class_name = frame_result.get('class_name')
-                shape_str = frame_result.get('shape')
-                # Process shape information required for Bytetrack input
-                try:
-                    height, width, channels = map(int, shape_str.split(','))
-                    img_info = (height, width, channels)
-                except ValueError:
-                    print(f"Invalid shape information for frame {frame_id}.")
-                    raise ValueError(
-                        f"Invalid shape information for frame {frame_id}.")
-
-                # Frames with missing required data: Skip ByteTrack processing
-                # but keep each frame for record with null info
-                if any(
-                        x in [None, ''] for x in
-                    [frame_id, boxes, scores, class_id, class_name, shape_str
-                     ]):
-                    tracking_results.append({
-                        "request_id":
-                        request_id,
-                        'frame_id':
-                        frame_id,
-                        'timestamp':
-                        timestamp,
-                        'track_id':
-                        None,
-                        'box': [{
-                            'x1': None,
-                            'y1': None,
-                            'x2': None,
-                            'y2': None
-                        }],
-                        'confidence':
-                        getattr(frame_result, 'confidence', None),
-                        'class_id':
-                        getattr(frame_result, 'class_id', None),
-                        'class_name':
-                        getattr(frame_result, 'class_name', None)
-                    })
-                    print(f"Missing required data: Skip ByteTrack processing\
-                            & append empty result for frame {frame_id}")
-                    continue
-
-                # Skip ByteTrack processing for frames with no detections
-                # but keep each frame for record with null info
-                if len(boxes) == 0:
-                    tracking_results.append({
-                        "request_id":
-                        request_id,
-                        'frame_id':
-                        frame_id,
-                        'timestamp':
-                        timestamp,
-                        'track_id':
-                        None,
-                        'box': [{
-                            'x1': None,
-                            'y1': None,
-                            'x2': None,
-                            'y2': None
-                        }],
-                        'confidence':
-                        getattr(frame_result, 'confidence', None),
-                        'class_id':
-                        getattr(frame_result, 'class_id', None),
-                        'class_name':
-                        getattr(frame_result, 'class_name', None)
-                    })
-                    print(f"No YOLO detections: Skip ByteTrack processing\
-                            & append empty result for frame {frame_id}")
-                    continue
-
-                # Prepare input for ByteTrack
-                try:
-                    bytetrack_input = []
-                    for box, score in zip(boxes, scores):
-                        x1, y1, x2, y2 = box
-                        bytetrack_input.append((x1, y1, x2, y2, score))
-                    # Convert to numpy array
-                    bytetrack_input = np.array(bytetrack_input)
-                    # print(f"processing bytetrack input for frame {frame_id}****: {bytetrack_input}")
-                except Exception as e:
-                    raise ValueError(f"Error preparing ByteTrack input\
-                                     for frame {frame_id}: {str(e)}")
-
-                # Run ByteTrack processing
-                try:
-                    online_targets = tracker.update(bytetrack_input, img_info,
-                                                    img_info)
-                    # Skip processing if Bytetrack return empty result
-                    # but keep each frame for record with null info
-                    if not online_targets:
-                        print(f"No online targets returned from Bytetrack:\
-                                Append empty result for frame {frame_id}")
-                        tracking_results.append({
-                            "request_id":
-                            request_id,
-                            'frame_id':
-                            frame_id,
-                            'timestamp':
-                            timestamp,
-                            'track_id':
-                            None,
-                            'box': [{
-                                'x1': None,
-                                'y1': None,
-                                'x2': None,
-                                'y2': None
-                            }],
-                            'confidence':
-                            None,
-                            'class_id':
-                            None,
-                            'class_name':
-                            None
-                        })
-                        continue
-                except Exception as e:
-                    raise RuntimeError(
-                        f"ByteTrack update failed for frame {frame_id},\
-                            {bytetrack_input}: {str(e)}")
-
-                # Process tracking results. Reference:
-                # https://github.com/ifzhang/ByteTrack/blob/d1bf0191adff59bc8fcfeaa0b33d3d1642552a99/tools/demo_track.py#L188
-                online_tlwhs = []
-                online_ids = []
-                online_scores = []
-                i = 0
-                for t in online_targets:
-                    tlwh = t.tlwh
-                    tid = getattr(t, 'track_id', None)
-                    vertical = tlwh[2] / tlwh[
-                        3] > BYTETrackerArgs.aspect_ratio_thresh
-                    if tlwh[2] * tlwh[
-                            3] > BYTETrackerArgs.min_box_area and not vertical:
-                        online_tlwhs.append(tlwh)
-                        online_ids.append(tid)
-                        online_scores.append(t.score)
-                        x1, y1, w, h = tlwh
-                        box = tuple(map(int, (x1, y1, x1 + w, y1 + h)))
-                        result_dict = {
-                            "request_id":
-                            request_id,
-                            'frame_id':
-                            frame_id,
-                            'timestamp':
-                            timestamp,
-                            'track_id':
-                            tid,
-                            'box': [{
-                                'x1': box[0],
-                                'y1': box[1],
-                                'x2': box[2],
-                                'y2': box[3]
-                            }],
-                            'confidence':
-                            round(float(t.score), 2),
-                            'class_id':
-                            int(class_id[i]),
-                            'class_name':
-                            class_name[i]
-                        }
-                        i += 1
-                        tracking_results.append(result_dict)
-                    else:
-                        print(f"Filtered detections:\
-                              Append empty result for frame {frame_id}")
-            except RuntimeError as e:
+                track_classes = import_snapshot(tracker, snapshot)
+            except (KeyError, TypeError, ValueError) as e:
                 return flask.jsonify(
-                    {'error': f"ByteTrack processing error: {str(e)}"}), 500
-            except Exception as e:
-                return flask.jsonify({
-                    'error':
-                    f"Unexpected error processing frame {frame_id}: {str(e)}"
-                }), 500
-
-        return flask.jsonify(tracking_results)
+                    {'error': f'Invalid tracker snapshot: {str(e)}'}), 400
+        try:
+            tracking_results = track_frames(tracker, track_classes,
+                                            detection_results)
+        except TrackingError as e:
+            return flask.jsonify({'error': str(e)}), 500
+
+        # ?snapshot=true also returns the final tracker state, for stitching
+        # track IDs across segments or tracking the next segment from it
+        if flask.request.args.get('snapshot', 'false').lower() == 'true':
+            return results_response(
+                tracking_results, results_format,
+                export_snapshot(tracker, track_classes))
+        return results_response(tracking_results, results_format)
     except Exception as e:
         return flask.jsonify(
             {'error': f"Unexpected error in ByteTrack service: {str(e)}"}), 500
 
 
+@app.route('/sessions', methods=['POST'])
+def open_session():
+    # Starts a streaming tracking session; takes the same ID options as
+    # /track and, optionally, a {'snapshot': {...}} body to continue from.
+    # Returns the session_id to push frames to.
+    not_ready = tracker_not_ready_response()
+    if not_ready:
+        return not_ready
+
+    try:
+        id_options = parse_id_options(flask.request.args)
+    except ValueError as e:
+        return flask.jsonify({'error': f'Invalid ID options: {str(e)}'}), 400
+
+    tracker = BYTETracker(BYTETrackerArgs(),
+                          id_generator=TrackIdGenerator(**id_options))
+    track_classes = {}
+    snapshot = (flask.request.get_json(silent=True) or {}).get('snapshot')
+    if snapshot:
+        try:
+            track_classes = import_snapshot(tracker, snapshot)
+        except (KeyError, TypeError, ValueError) as e:
+            return flask.jsonify(
+                {'error': f'Invalid tracker snapshot: {str(e)}'}), 400
+
+    session = sessions.open(tracker)
+    if session is None:
+        return flask.jsonify(
+            {'error': f'Too many open sessions (max {MAX_SESSIONS})'}), 429
+    session.track_classes = track_classes
+    logger.info(f"Opened tracking session {session.session_id}")
+    return flask.jsonify({
+        'session_id': session.session_id,
+        'idle_timeout': SESSION_IDLE_TIMEOUT
+    }), 201
+
+
+@app.route('/sessions/<session_id>/frames', methods=['POST'])
+def push_frames(session_id):
+    # Tracks the next batch of detection frames (same format as /track)
+    # with the session's tracker and returns their tracking records, in
+    # the ?format= of /track
+    session = sessions.get(session_id)
+    if session is None:
+        return flask.jsonify(
+            {'error': f'Unknown or expired session: {session_id}'}), 404
+    try:
+        results_format = parse_results_format(flask.request.args)
+    except ValueError as e:
+        return flask.jsonify({'error': str(e)}), 400
+
+    detection_results = read_request_body()
+    if not (isinstance(detection_results, list)
+            or is_columnar(detection_results)):
+        return flask.jsonify({'error': 'Expected a list of frames'}), 400
+
+    with session.lock:
+        try:
+            tracking_results = track_frames(session.tracker,
+                                            session.track_classes,
+                                            detection_results)
+        except TrackingError as e:
+            return flask.jsonify({'error': str(e)}), 500
+        finally:
+            session.last_used = time.monotonic()
+        session.frame_count += len(tracking_results.frame_ids)
+    return results_response(tracking_results, results_format)
+
+
+@app.route('/sessions/<session_id>/snapshot')
+def session_snapshot(session_id):
+    session = sessions.get(session_id)
+    if session is None:
+        return flask.jsonify(
+            {'error': f'Unknown or expired session: {session_id}'}), 404
+    with session.lock:
+        return flask.jsonify(
+            export_snapshot(session.tracker, session.track_classes))
+
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def close_session(session_id):
+    session = sessions.close(session_id)
+    if session is None:
+        return flask.jsonify(
+            {'error': f'Unknown or expired session: {session_id}'}), 404
+    logger.info(f"Closed tracking session {session_id} after "
+                f"{session.frame_count} frames")
+    return flask.jsonify({
+        'session_id': session_id,
+        'frames': session.frame_count
+    }), 200
+
+
 if __name__ == '__main__':
+    load_tracker_in_background()
+    sessions.start_reaper(interval=min(SESSION_IDLE_TIMEOUT, 60))
     app.run(host='0.0.0.0', port=5001)
@@ -0,0 +1,179 @@
+"""Sparse alternative to matching.iou_distance + matching.linear_assignment
+for crowded scenes.
+
+Only track/detection pairs whose boxes overlap (and share a class, when
+classes are given) can have an IoU cost below the assignment threshold,
+so candidate pairs are found through a uniform grid instead of a dense
+tracks x detections IoU matrix. Pairs that cannot be matched are dropped,
+and assignment runs separately on each connected component of the
+remaining pairs. Components never compete for the same track or detection,
+so the result is the same as the dense assignment.
+"""
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from yolox.tracker import matching
+
+
+def pair_ious(atlbrs, btlbrs):
+    """IoU of atlbrs[i] with btlbrs[i], using the same +1 pixel convention
+    and operation order as matching.ious (cython_bbox.bbox_overlaps).
+    """
+    iw = (np.minimum(atlbrs[:, 2], btlbrs[:, 2]) -
+          np.maximum(atlbrs[:, 0], btlbrs[:, 0]) + 1)
+    ih = (np.minimum(atlbrs[:, 3], btlbrs[:, 3]) -
+          np.maximum(atlbrs[:, 1], btlbrs[:, 1]) + 1)
+    overlap = (iw > 0) & (ih > 0)
+    intersection = np.where(overlap, iw * ih, 0.)
+    box_area = ((btlbrs[:, 2] - btlbrs[:, 0] + 1) *
+                (btlbrs[:, 3] - btlbrs[:, 1] + 1))
+    union = ((atlbrs[:, 2] - atlbrs[:, 0] + 1) *
+             (atlbrs[:, 3] - atlbrs[:, 1] + 1) + box_area - intersection)
+    return np.where(overlap, intersection / union, 0.)
+
+
+def _grid_cells(tlbrs, class_codes, cell_size, origin, grid_shape, pad):
+    # (box index, cell key) for every grid cell each padded box touches.
+    # The key includes the class so boxes of different classes never meet.
+    first = np.floor((tlbrs[:, :2] - pad - origin) / cell_size).astype(
+        np.int64)
+    last = np.floor((tlbrs[:, 2:] + pad - origin) / cell_size).astype(
+        np.int64)
+    span = last - first + 1
+    counts = span[:, 0] * span[:, 1]
+    box_index = np.repeat(np.arange(len(tlbrs)), counts)
+    offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                 counts)
+    cell_x = first[box_index, 0] + offset % span[box_index, 0]
+    cell_y = first[box_index, 1] + offset // span[box_index, 0]
+    keys = ((class_codes[box_index] * grid_shape[1] + cell_y) *
+            grid_shape[0] + cell_x)
+    return box_index, keys
+
+
+def candidate_pairs(atlbrs, btlbrs, aclasses=None, bclasses=None, margin=0.):
+    """Index pairs (a, b) of boxes that overlap once each box is grown by
+    margin pixels, restricted to equal classes when classes are given.
+    """
+    if aclasses is None or bclasses is None:
+        class_codes = np.zeros(len(atlbrs) + len(btlbrs), dtype=np.int64)
+    else:
+        _, class_codes = np.unique(np.concatenate(
+            [np.asarray(aclasses), np.asarray(bclasses)]),
+                                   return_inverse=True)
+        class_codes = class_codes.reshape(-1)
+    boxes = np.concatenate([atlbrs, btlbrs])
+
+    # The +1 pixel IoU convention counts boxes 1px apart as overlapping
+    pad = 1 + margin
+    sizes = boxes[:, 2:] - boxes[:, :2]
+    cell_size = max(float(np.median(sizes)) + 2 * pad, 1.)
+    origin = boxes[:, :2].min(axis=0) - pad
+    grid_shape = (np.floor(
+        (boxes[:, 2:].max(axis=0) + pad - origin) / cell_size).astype(
+            np.int64) + 1)
+
+    a_index, a_keys = _grid_cells(atlbrs, class_codes[:len(atlbrs)],
+                                  cell_size, origin, grid_shape, pad)
+    b_index, b_keys = _grid_cells(btlbrs, class_codes[len(atlbrs):],
+                                  cell_size, origin, grid_shape, pad)
+
+    # Join a and b cell entries on their key
+    order = np.argsort(b_keys, kind='stable')
+    b_keys, b_index = b_keys[order], b_index[order]
+    start = np.searchsorted(b_keys, a_keys, side='left')
+    counts = np.searchsorted(b_keys, a_keys, side='right') - start
+    pair_a = np.repeat(a_index, counts)
+    pair_b = b_index[np.repeat(start, counts) + np.arange(counts.sum()) -
+                     np.repeat(np.cumsum(counts) - counts, counts)]
+
+    # Boxes sharing several cells meet more than once
+    pairs = np.unique(pair_a * len(btlbrs) + pair_b)
+    pair_a, pair_b = pairs // len(btlbrs), pairs % len(btlbrs)
+    a, b = atlbrs[pair_a], btlbrs[pair_b]
+    overlap = ((np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]) +
+                1 + 2 * margin > 0) &
+               (np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]) +
+                1 + 2 * margin > 0))
+    return pair_a[overlap], pair_b[overlap]
+
+
+def gated_assignment(atlbrs,
+                     btlbrs,
+                     thresh,
+                     aclasses=None,
+                     bclasses=None,
+                     bscores=None,
+                     margin=0.):
+    """Same result as linear_assignment on iou_distance(atlbrs, btlbrs)
+    (fused with bscores when given, as matching.fuse_score does), without
+    building the dense cost matrix. With classes, a and b only match
+    within the same class.
+    :return: matches (K x 2, sorted by a), unmatched a, unmatched b
+    """
+    atlbrs = np.asarray(atlbrs, dtype=np.float64).reshape(-1, 4)
+    btlbrs = np.asarray(btlbrs, dtype=np.float64).reshape(-1, 4)
+    n_a, n_b = len(atlbrs), len(btlbrs)
+    if n_a == 0 or n_b == 0:
+        return matching.linear_assignment(np.empty((n_a, n_b)), thresh)
+    if thresh >= 1:
+        # Boxes that do not overlap (cost 1) can match; nothing to prune
+        raise ValueError('gated_assignment needs thresh < 1')
+
+    pair_a, pair_b = candidate_pairs(atlbrs, btlbrs, aclasses, bclasses,
+                                     margin)
+    cost = 1 - pair_ious(atlbrs[pair_a], btlbrs[pair_b])
+    if bscores is not None:
+        cost = 1 - (1 - cost) * np.asarray(bscores)[pair_b]
+    # Pairs above the threshold are never part of the assignment
+    matchable = cost <= thresh
+    pair_a, pair_b, cost = pair_a[matchable], pair_b[matchable], cost[
+        matchable]
+
+    # Connected components over tracks (0..n_a-1) and detections (n_a..)
+    graph = coo_matrix((np.ones(len(pair_a)), (pair_a, n_a + pair_b)),
+                       shape=(n_a + n_b, n_a + n_b))
+    n_components, labels = connected_components(graph, directed=False)
+    pair_labels = labels[pair_a]
+    a_per_component = np.bincount(labels[:n_a], minlength=n_components)
+    b_per_component = np.bincount(labels[n_a:], minlength=n_components)
+
+    # A component with a single track or detection on one side (including
+    # a lone pair) is assigned its cheapest pair
+    star = ((a_per_component[pair_labels] == 1) |
+            (b_per_component[pair_labels] == 1))
+    order = np.lexsort((cost[star], pair_labels[star]))
+    star_a, star_b = pair_a[star][order], pair_b[star][order]
+    star_labels = pair_labels[star][order]
+    cheapest = np.ones(len(star_labels), dtype=bool)
+    cheapest[1:] = star_labels[1:] != star_labels[:-1]
+    matches = [np.stack([star_a[cheapest], star_b[cheapest]], axis=1)]
+
+    multi = ~star
+    order = np.argsort(pair_labels[multi], kind='stable')
+    multi_a, multi_b = pair_a[multi][order], pair_b[multi][order]
+    multi_cost, multi_labels = cost[multi][order], pair_labels[multi][order]
+    bounds = np.flatnonzero(np.diff(multi_labels)) + 1
+    for a, b, c in zip(np.split(multi_a, bounds), np.split(multi_b, bounds),
+                       np.split(multi_cost, bounds)):
+        if len(a) == 0:
+            continue
+        rows, a_local = np.unique(a, return_inverse=True)
+        cols, b_local = np.unique(b, return_inverse=True)
+        dists = np.ones((len(rows), len(cols)))
+        dists[a_local, b_local] = c
+        component_matches, _, _ = matching.linear_assignment(dists, thresh)
+        component_matches = np.asarray(component_matches,
+                                       dtype=np.int64).reshape(-1, 2)
+        matches.append(
+            np.stack([
+                rows[component_matches[:, 0]], cols[component_matches[:, 1]]
+            ],
+                     axis=1))
+
+    matches = np.concatenate(matches).astype(np.int64)
+    matches = matches[np.argsort(matches[:, 0], kind='stable')]
+    unmatched_a = np.setdiff1d(np.arange(n_a), matches[:, 0])
+    unmatched_b = np.setdiff1d(np.arange(n_b), matches[:, 1])
+    return matches, unmatched_a, unmatched_b
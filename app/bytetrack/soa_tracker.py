@@ -0,0 +1,405 @@
+# Structure-of-arrays ByteTrack core. Same association logic and outputs
+# as yolox.tracker.byte_tracker.BYTETracker, but all track state lives in
+# contiguous NumPy arrays indexed by row: predict, Kalman correction and
+# track initiation run once per frame over every affected track, and the
+# tracked/lost lists are ordered arrays of row indices instead of lists of
+# STrack objects rebuilt through dicts every frame.
+from collections import namedtuple
+
+import numpy as np
+
+from yolox.tracker import matching
+from yolox.tracker.basetrack import TrackIdGenerator, TrackState
+from yolox.tracker.byte_tracker import BatchKalmanFilter
+from yolox.tracker.gated_matching import gated_assignment
+
+# What update()/predict_only() return per output track - the attributes
+# callers read from an STrack
+TrackOutput = namedtuple('TrackOutput',
+                         ['track_id', 'tlwh', 'score', 'det_index'])
+
+
+def tlbr_to_tlwh(tlbr):
+    ret = tlbr.copy()
+    ret[:, 2:] -= ret[:, :2]
+    return ret
+
+
+def tlwh_to_tlbr(tlwh):
+    ret = tlwh.copy()
+    ret[:, 2:] += ret[:, :2]
+    return ret
+
+
+def tlwh_to_xyah(tlwh):
+    ret = tlwh.copy()
+    ret[:, :2] += ret[:, 2:] / 2
+    ret[:, 2] /= ret[:, 3]
+    return ret
+
+
+def mean_to_tlwh(mean):
+    ret = mean[:, :4].copy()
+    ret[:, 2] *= ret[:, 3]
+    ret[:, :2] -= ret[:, 2:] / 2
+    return ret
+
+
+def fuse_score(cost_matrix, scores):
+    if cost_matrix.size == 0:
+        return cost_matrix
+    return 1 - (1 - cost_matrix) * scores[None, :]
+
+
+def kalman_initiate(kalman_filter, measurement):
+    # KalmanFilter.initiate for every row of measurement
+    height = measurement[:, 3]
+    weight_position = 2 * kalman_filter._std_weight_position * height
+    weight_velocity = 10 * kalman_filter._std_weight_velocity * height
+    std = np.stack([
+        weight_position, weight_position,
+        np.full_like(height, 1e-2), weight_position, weight_velocity,
+        weight_velocity,
+        np.full_like(height, 1e-5), weight_velocity
+    ],
+                   axis=1)
+    mean = np.concatenate([measurement, np.zeros_like(measurement)], axis=1)
+    covariance = np.zeros((len(measurement), 8, 8))
+    covariance[:, np.arange(8), np.arange(8)] = np.square(std)
+    return mean, covariance
+
+
+class SoATracker(object):
+    # Drop-in for BYTETracker: same constructor, update() and
+    # predict_only(), returning TrackOutput tuples instead of STracks
+
+    def __init__(self, args, frame_rate=30, id_generator=None,
+                 capacity=64):
+        self.id_generator = id_generator or TrackIdGenerator()
+        self.frame_id = 0
+        self.args = args
+        self.det_thresh = args.track_thresh + 0.1
+        self.buffer_size = int(frame_rate / 30.0 * args.track_buffer)
+        self.max_time_lost = self.buffer_size
+        self.kalman_filter = BatchKalmanFilter()
+        self.kalman_dtype = (np.float32 if getattr(
+            args, 'kalman_float32', False) else np.float64)
+        self.association = getattr(args, 'association', 'dense')
+        self.gate_margin = getattr(args, 'gate_margin', 0.)
+
+        # Per-track state, one row per track
+        self.mean = np.zeros((capacity, 8))
+        self.covariance = np.zeros((capacity, 8, 8))
+        self.score = np.zeros(capacity)
+        self.classes = np.zeros(capacity)
+        self.state = np.zeros(capacity, dtype=np.int8)
+        self.is_activated = np.zeros(capacity, dtype=bool)
+        # BYTETracker drops lost tracks whose ID is already in its removed
+        # list; this flags the rows that have ever been removed
+        self.was_removed = np.zeros(capacity, dtype=bool)
+        self.last_frame = np.zeros(capacity, dtype=np.int64)
+        self.start_frame = np.zeros(capacity, dtype=np.int64)
+        self.tracklet_len = np.zeros(capacity, dtype=np.int64)
+        self.track_ids = np.empty(capacity, dtype=object)
+        # Row of update()'s output_results each track last matched, -1
+        # when it was not matched in the current frame
+        self.det_index = np.full(capacity, -1, dtype=np.int64)
+        self._free_rows = list(range(capacity - 1, -1, -1))
+
+        # Ordered row indices, mirroring tracked_stracks and lost_stracks
+        self.tracked = np.empty(0, dtype=np.int64)
+        self.lost = np.empty(0, dtype=np.int64)
+
+    def _grow(self, needed):
+        capacity = len(self.mean)
+        new_capacity = max(capacity * 2, capacity + needed)
+        for name in ('mean', 'covariance', 'score', 'classes', 'state',
+                     'is_activated',
+                     'was_removed', 'last_frame', 'start_frame',
+                     'tracklet_len', 'track_ids', 'det_index'):
+            old = getattr(self, name)
+            new = np.zeros((new_capacity, ) + old.shape[1:], dtype=old.dtype)
+            if old.dtype == object:
+                new[:] = None
+            new[:capacity] = old
+            setattr(self, name, new)
+        self._free_rows.extend(range(new_capacity - 1, capacity - 1, -1))
+
+    def _allocate(self, count):
+        if count > len(self._free_rows):
+            self._grow(count - len(self._free_rows))
+        return np.array([self._free_rows.pop() for _ in range(count)],
+                        dtype=np.int64)
+
+    def _release_dead_rows(self, rows):
+        # Rows in neither list are never referenced again
+        alive = np.concatenate([self.tracked, self.lost])
+        self._free_rows.extend(
+            int(row) for row in np.setdiff1d(rows, alive))
+
+    def _tlbr(self, rows):
+        return tlwh_to_tlbr(mean_to_tlwh(self.mean[rows]))
+
+    def _predict(self, rows):
+        if len(rows) == 0:
+            return
+        mean = self.mean[rows].copy()
+        mean[self.state[rows] != TrackState.Tracked, 7] = 0
+        self.mean[rows], self.covariance[rows] = \
+            self.kalman_filter.multi_predict(mean, self.covariance[rows])
+
+    def _correct(self, rows, det_tlwh, det_scores, det_index, frame_id):
+        # STrack.update / re_activate for matched rows: Kalman correction
+        # plus bookkeeping, in one batched call
+        if len(rows) == 0:
+            return
+        self.mean[rows], self.covariance[rows] = \
+            self.kalman_filter.multi_update(self.mean[rows],
+                                            self.covariance[rows],
+                                            tlwh_to_xyah(det_tlwh),
+                                            dtype=self.kalman_dtype)
+        refound = self.state[rows] != TrackState.Tracked
+        self.tracklet_len[rows] = np.where(refound, 0,
+                                           self.tracklet_len[rows] + 1)
+        self.state[rows] = TrackState.Tracked
+        self.is_activated[rows] = True
+        self.last_frame[rows] = frame_id
+        self.score[rows] = det_scores
+        self.det_index[rows] = det_index
+
+    def _activate(self, det_tlwh, det_scores, det_classes, det_index):
+        rows = self._allocate(len(det_tlwh))
+        if len(rows) == 0:
+            return rows
+        self.mean[rows], self.covariance[rows] = kalman_initiate(
+            self.kalman_filter, tlwh_to_xyah(det_tlwh))
+        for row in rows:
+            self.track_ids[row] = self.id_generator()
+        self.score[rows] = det_scores
+        self.classes[rows] = det_classes
+        self.det_index[rows] = det_index
+        self.tracklet_len[rows] = 0
+        self.state[rows] = TrackState.Tracked
+        self.is_activated[rows] = self.frame_id == 1
+        self.was_removed[rows] = False
+        self.last_frame[rows] = self.frame_id
+        self.start_frame[rows] = self.frame_id
+        return rows
+
+    def _associate(self, rows, det_tlwh, det_scores, det_classes, thresh,
+                   fuse=True):
+        # BYTETracker.associate on rows; returns matches as a K x 2 array
+        fuse = fuse and not self.args.mot20
+        if self.association == 'gated':
+            matches, u_track, u_detection = gated_assignment(
+                self._tlbr(rows),
+                tlwh_to_tlbr(det_tlwh),
+                thresh,
+                aclasses=self.classes[rows],
+                bclasses=det_classes,
+                bscores=det_scores if fuse else None,
+                margin=self.gate_margin)
+        else:
+            dists = matching.iou_distance(self._tlbr(rows),
+                                          tlwh_to_tlbr(det_tlwh))
+            if fuse:
+                dists = fuse_score(dists, det_scores)
+            matches, u_track, u_detection = matching.linear_assignment(
+                dists, thresh=thresh)
+        return (np.asarray(matches, dtype=np.int64).reshape(-1, 2),
+                np.asarray(u_track, dtype=np.int64),
+                np.asarray(u_detection, dtype=np.int64))
+
+    def _outputs(self, rows):
+        tlwhs = mean_to_tlwh(self.mean[rows])
+        return [
+            TrackOutput(self.track_ids[row], tlwh, self.score[row],
+                        self.det_index[row])
+            for row, tlwh in zip(rows, tlwhs)
+        ]
+
+    def update(self, output_results, img_info, img_size, classes=None):
+        self.frame_id += 1
+        output_results = np.asarray(output_results, dtype=np.float64)
+        if output_results.shape[1] == 5:
+            scores = output_results[:, 4]
+            bboxes = output_results[:, :4]
+        else:
+            scores = output_results[:, 4] * output_results[:, 5]
+            bboxes = output_results[:, :4]
+        img_h, img_w = img_info[0], img_info[1]
+        scale = min(img_size[0] / float(img_h), img_size[1] / float(img_w))
+        bboxes = bboxes / scale
+        if classes is None:
+            classes = np.zeros(len(scores))
+        classes = np.asarray(classes, dtype=np.float64)
+
+        remain_inds = scores > self.args.track_thresh
+        inds_second = np.logical_and(scores > 0.1,
+                                     scores < self.args.track_thresh)
+        # Detections keep the tlwh an STrack would hold, and the tlbr it
+        # would derive from it
+        det_tlwh = tlbr_to_tlwh(bboxes[remain_inds])
+        det_scores = scores[remain_inds]
+        det_classes = classes[remain_inds]
+        det_index = np.flatnonzero(remain_inds)
+        second_tlwh = tlbr_to_tlwh(bboxes[inds_second])
+        second_scores = scores[inds_second]
+        second_classes = classes[inds_second]
+        second_index = np.flatnonzero(inds_second)
+
+        ''' Add newly detected tracklets to tracked_stracks'''
+        confirmed_mask = self.is_activated[self.tracked]
+        unconfirmed = self.tracked[~confirmed_mask]
+
+        ''' Step 2: First association, with high score detection boxes'''
+        strack_pool = np.concatenate(
+            [self.tracked[confirmed_mask], self.lost])
+        self._predict(strack_pool)
+        matches, u_track, u_detection = self._associate(
+            strack_pool, det_tlwh, det_scores, det_classes,
+            self.args.match_thresh)
+        matched_rows = strack_pool[matches[:, 0]]
+        refind_rows = matched_rows[
+            self.state[matched_rows] != TrackState.Tracked]
+        activated_rows = [matched_rows[self.state[matched_rows] ==
+                                       TrackState.Tracked]]
+        self._correct(matched_rows, det_tlwh[matches[:, 1]],
+                      det_scores[matches[:, 1]], det_index[matches[:, 1]],
+                      self.frame_id)
+
+        ''' Step 3: Second association, with low score detection boxes'''
+        u_track = strack_pool[u_track]
+        r_tracked = u_track[self.state[u_track] == TrackState.Tracked]
+        matches, u_track, _ = self._associate(r_tracked,
+                                              second_tlwh,
+                                              second_scores,
+                                              second_classes,
+                                              0.5,
+                                              fuse=False)
+        matched_rows = r_tracked[matches[:, 0]]
+        activated_rows.append(matched_rows)
+        self._correct(matched_rows, second_tlwh[matches[:, 1]],
+                      second_scores[matches[:, 1]],
+                      second_index[matches[:, 1]], self.frame_id)
+
+        new_lost = r_tracked[u_track]
+        new_lost = new_lost[self.state[new_lost] != TrackState.Lost]
+        self.state[new_lost] = TrackState.Lost
+
+        '''Deal with unconfirmed tracks, usually tracks with only one beginning frame'''
+        det_tlwh = det_tlwh[u_detection]
+        det_scores = det_scores[u_detection]
+        det_classes = det_classes[u_detection]
+        det_index = det_index[u_detection]
+        matches, u_unconfirmed, u_detection = self._associate(
+            unconfirmed, det_tlwh, det_scores, det_classes, 0.7)
+        matched_rows = unconfirmed[matches[:, 0]]
+        activated_rows.append(matched_rows)
+        self._correct(matched_rows, det_tlwh[matches[:, 1]],
+                      det_scores[matches[:, 1]], det_index[matches[:, 1]],
+                      self.frame_id)
+        removed_rows = [unconfirmed[u_unconfirmed]]
+        self.state[removed_rows[0]] = TrackState.Removed
+
+        """ Step 4: Init new stracks"""
+        u_detection = u_detection[det_scores[u_detection] >= self.det_thresh]
+        new_rows = self._activate(det_tlwh[u_detection],
+                                  det_scores[u_detection],
+                                  det_classes[u_detection],
+                                  det_index[u_detection])
+        activated_rows.append(new_rows)
+
+        """ Step 5: Update state"""
+        expired = self.lost[self.frame_id - self.last_frame[self.lost] >
+                            self.max_time_lost]
+        self.state[expired] = TrackState.Removed
+        removed_rows.append(expired)
+
+        # Same list bookkeeping as BYTETracker, on row indices. Tracked
+        # and lost are disjoint, so joint/sub reduce to order-preserving
+        # concatenation and masking.
+        previous_rows = np.concatenate([self.tracked, self.lost])
+        tracked = self.tracked[self.state[self.tracked] == TrackState.Tracked]
+        for rows in activated_rows + [refind_rows]:
+            tracked = np.concatenate([tracked, rows[~np.isin(rows, tracked)]])
+        lost = self.lost[~np.isin(self.lost, tracked)]
+        lost = np.concatenate([lost, new_lost[~np.isin(new_lost, lost)]])
+        lost = lost[~self.was_removed[lost]]
+        self.was_removed[np.concatenate(removed_rows)] = True
+        self.tracked, self.lost = self._remove_duplicates(tracked, lost)
+        self._release_dead_rows(np.concatenate([previous_rows, new_rows]))
+
+        return self._outputs(self.tracked[self.is_activated[self.tracked]])
+
+    def _remove_duplicates(self, tracked, lost):
+        pdist = matching.iou_distance(self._tlbr(tracked), self._tlbr(lost))
+        pairs_a, pairs_b = np.where(pdist < 0.15)
+        if len(pairs_a) == 0:
+            return tracked, lost
+        age_a = (self.last_frame[tracked[pairs_a]] -
+                 self.start_frame[tracked[pairs_a]])
+        age_b = (self.last_frame[lost[pairs_b]] -
+                 self.start_frame[lost[pairs_b]])
+        keep_a = np.ones(len(tracked), dtype=bool)
+        keep_b = np.ones(len(lost), dtype=bool)
+        keep_a[pairs_a[age_a <= age_b]] = False
+        keep_b[pairs_b[age_a > age_b]] = False
+        return tracked[keep_a], lost[keep_b]
+
+    def active_track_ids(self):
+        return list(self.track_ids[np.concatenate([self.tracked, self.lost])])
+
+    def export_state(self):
+        # Same snapshot format as BYTETracker.export_state, so snapshots
+        # move freely between the two cores
+        rows = np.concatenate([self.tracked, self.lost])
+        return {
+            'frame_id': self.frame_id,
+            'ids': self.id_generator.state(),
+            'tracks': [{
+                'track_id': self.track_ids[row],
+                'state': int(self.state[row]),
+                'is_activated': bool(self.is_activated[row]),
+                'mean': self.mean[row].tolist(),
+                'covariance': self.covariance[row].tolist(),
+                'score': float(self.score[row]),
+                'class_id': float(self.classes[row]),
+                'tracklet_len': int(self.tracklet_len[row]),
+                'start_frame': int(self.start_frame[row]),
+                'frame_id': int(self.last_frame[row]),
+            } for row in rows],
+            'removed_ids': list(self.track_ids[rows[self.was_removed[rows]]]),
+        }
+
+    def import_state(self, snapshot):
+        # Continue from an export_state() snapshot, replacing every track
+        self.frame_id = snapshot['frame_id']
+        self.id_generator = TrackIdGenerator.from_state(snapshot['ids'])
+        self._free_rows = list(range(len(self.mean) - 1, -1, -1))
+        tracks = snapshot['tracks']
+        removed_ids = set(snapshot.get('removed_ids', []))
+        rows = self._allocate(len(tracks))
+        for row, track in zip(rows, tracks):
+            self.track_ids[row] = track['track_id']
+            self.state[row] = track['state']
+            self.is_activated[row] = track['is_activated']
+            self.mean[row] = track['mean']
+            self.covariance[row] = track['covariance']
+            self.score[row] = track['score']
+            self.classes[row] = track['class_id']
+            self.tracklet_len[row] = track['tracklet_len']
+            self.start_frame[row] = track['start_frame']
+            self.last_frame[row] = track['frame_id']
+            self.was_removed[row] = track['track_id'] in removed_ids
+            self.det_index[row] = -1
+        self.tracked = rows[self.state[rows] == TrackState.Tracked]
+        self.lost = rows[self.state[rows] != TrackState.Tracked]
+
+    def predict_only(self):
+        # BYTETracker.predict_only: advance a frame on Kalman prediction
+        self.frame_id += 1
+        rows = np.concatenate([self.tracked, self.lost])
+        self._predict(rows)
+        self.det_index[rows] = -1
+        return self._outputs(self.tracked[self.is_activated[self.tracked]])
@@ -0,0 +1,390 @@
+# Conversion between /track payloads and NumPy arrays. Request frames are
+# parsed into flat per-detection arrays in one pass, and tracking results
+# are kept as columns and serialized straight from them, so no per-track
+# dicts are built on either side.
+#
+# Results go out per frame (one record per track per frame, the default)
+# or as tracklets (?format=tracklets), one record per track ID:
+#   {"format": "tracklets", "request_id": ...,
+#    "frames": [[frame_id, timestamp], ...],       every frame of the request
+#    "tracklets": [{"track_id": ..., "class_id": ..., "class_name": ...,
+#                   "start_frame": ..., "end_frame": ...,
+#                   "frame_ids": [...],            only if the track has gaps
+#                   "boxes": [x1, y1, x2, y2, ...], one box per frame
+#                   "scores": [...],
+#                   "predicted": [frame_id, ...],  only if any
+#                   "class_changes": [[frame_id, class_id, class_name],
+#                                     ...]}]}      only if any
+# Without frame_ids, a tracklet covers every frame from start_frame to
+# end_frame in "frames" order; frames no tracklet covers had no tracks.
+# The order of tracks within a frame is not kept: tracklets come in order
+# of first appearance.
+# Consumers convert tracklets back to per-frame records with
+# app/shared/tracklets.py; keep the two in step.
+#
+# With MessagePack (application/x-msgpack), detections come in and per-frame
+# results go out as columns of flat little-endian arrays: detections as
+# produced by YOLO's columnar_detections(), results as described in
+# TrackResults.to_columns().
+import json
+
+import numpy as np
+
+# Records are laid out as flask.jsonify would: sorted keys, compact
+_RECORD = ('{"box":[{"x1":%d,"x2":%d,"y1":%d,"y2":%d}],"class_id":%s,'
+           '"class_name":%s,"confidence":%r,"frame_id":%s,%s"request_id":%s,'
+           '"timestamp":%s,"track_id":%s}')
+_PLACEHOLDER = ('{"box":[{"x1":null,"x2":null,"y1":null,"y2":null}],'
+                '"class_id":null,"class_name":null,"confidence":null,'
+                '"frame_id":%s,"request_id":%s,"timestamp":%s,'
+                '"track_id":null}')
+_PREDICTED = '"predicted":true,'
+
+
+def dumps(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+class FrameError(ValueError):
+    # Invalid frame in a /track payload
+
+    def __init__(self, frame_id, message):
+        super().__init__(message)
+        self.frame_id = frame_id
+
+
+class DetectionPayload:
+    # The frames of a /track request as flat arrays with one row per
+    # detection (detections, class_ids, class_names) and per-frame
+    # metadata lists. Frame i owns rows offsets[i]:offsets[i + 1].
+
+    def __init__(self, detection_results):
+        self.request_ids = []
+        self.frame_ids = []
+        self.timestamps = []
+        self.shapes = []
+        # Frames skipped by YOLO (frame_stride), tracked on prediction
+        self.predicted = []
+        # Frames with missing data or no detections, reported as a
+        # placeholder record without being tracked
+        self.placeholder = []
+        counts = []
+        boxes, scores, class_ids, class_names = [], [], [], []
+
+        for frame_result in detection_results:
+            frame_id = frame_result.get('frame_id')
+            box = frame_result.get('box')
+            confidence = frame_result.get('confidence')
+            class_id = frame_result.get('class_id')
+            class_name = frame_result.get('class_name')
+            shape_str = frame_result.get('shape')
+            # Shape information is required for Bytetrack input
+            try:
+                shape = tuple(map(int, shape_str.split(',')))
+                if len(shape) != 3:
+                    raise ValueError
+            except (AttributeError, ValueError):
+                raise FrameError(
+                    frame_id, f"Invalid shape information for frame "
+                    f"{frame_id}.")
+            predicted = frame_result.get('detected') is False
+            placeholder = not predicted and (any(
+                x is None or x == '' for x in
+                [frame_id, box, confidence, class_id, class_name, shape_str])
+                                             or len(box) == 0)
+            count = 0
+            if not predicted and not placeholder:
+                count = len(box)
+                if not (len(confidence) == len(class_id) == len(class_name) ==
+                        count):
+                    raise FrameError(
+                        frame_id, f"Mismatched detection fields for frame "
+                        f"{frame_id}")
+                boxes.extend(box)
+                scores.extend(confidence)
+                class_ids.extend(class_id)
+                class_names.extend(class_name)
+
+            self.request_ids.append(frame_result.get('request_id'))
+            self.frame_ids.append(frame_id)
+            self.timestamps.append(frame_result.get('timestamp'))
+            self.shapes.append(shape)
+            self.predicted.append(predicted)
+            self.placeholder.append(placeholder)
+            counts.append(count)
+
+        self.offsets = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+        try:
+            self.detections = np.empty((len(scores), 5))
+            self.detections[:, :4] = np.asarray(boxes,
+                                                dtype=np.float64).reshape(
+                                                    -1, 4)
+            self.detections[:, 4] = np.asarray(scores, dtype=np.float64)
+            self.class_ids = np.asarray(class_ids, dtype=np.float64)
+        except (TypeError, ValueError) as e:
+            raise FrameError(self._bad_frame(boxes, scores, class_ids),
+                             f"Error preparing ByteTrack input: {str(e)}")
+        self.class_names = np.empty(len(class_names), dtype=object)
+        self.class_names[:] = class_names
+
+    @classmethod
+    def from_columns(cls, columns):
+        # Payload from YOLO's columnar detection format, read straight into
+        # arrays without per-frame records
+        payload = cls.__new__(cls)
+        try:
+            frame_count = len(columns['frame_ids'])
+            payload.frame_ids = list(columns['frame_ids'])
+            payload.request_ids = [columns.get('request_id')] * frame_count
+            payload.timestamps = np.frombuffer(columns['timestamps'],
+                                               dtype='<f8').tolist()
+            shapes = [tuple(map(int, shape)) for shape in columns['shapes']]
+            payload.shapes = [
+                shapes[k] for k in np.frombuffer(columns['shape_index'],
+                                                 dtype='<i4').tolist()
+            ]
+            counts = np.frombuffer(columns['counts'], dtype='<i4')
+            detected = np.frombuffer(columns['detected'], dtype=bool)
+            boxes = np.frombuffer(columns['boxes'], dtype='<f8').reshape(-1, 4)
+            scores = np.frombuffer(columns['scores'], dtype='<f8')
+            class_ids = np.frombuffer(columns['class_ids'], dtype='<i4')
+            class_index = np.frombuffer(columns['class_index'], dtype='<i4')
+            class_names = np.empty(len(columns['class_names']), dtype=object)
+            class_names[:] = columns['class_names']
+            class_names = class_names[class_index]
+        except (KeyError, TypeError, ValueError, IndexError) as e:
+            raise FrameError(None, f"Invalid columnar payload: {str(e)}")
+        if not (len(payload.timestamps) == len(payload.shapes) == len(counts)
+                == len(detected) == frame_count):
+            raise FrameError(None, "Mismatched per-frame columns")
+        if not (len(boxes) == len(scores) == len(class_ids) ==
+                len(class_index) == counts.sum()):
+            raise FrameError(None, "Mismatched detection columns")
+        if any(len(shape) != 3 for shape in shapes):
+            raise FrameError(None, "Invalid shape information")
+
+        payload.predicted = (~detected).tolist()
+        # Detected frames without detections, as in the JSON payload
+        payload.placeholder = (detected & (counts == 0)).tolist()
+        payload.offsets = np.concatenate(
+            [[0], np.cumsum(counts, dtype=np.int64)])
+        payload.detections = np.empty((len(scores), 5))
+        payload.detections[:, :4] = boxes
+        payload.detections[:, 4] = scores
+        payload.class_ids = class_ids.astype(np.float64)
+        payload.class_names = class_names
+        return payload
+
+    def __len__(self):
+        return len(self.frame_ids)
+
+    def _bad_frame(self, boxes, scores, class_ids):
+        # frame_id of the first frame whose detections do not convert
+        for i in range(len(self)):
+            start, end = self.offsets[i], self.offsets[i + 1]
+            try:
+                np.asarray(boxes[start:end], dtype=np.float64).reshape(-1, 4)
+                np.asarray(scores[start:end], dtype=np.float64)
+                np.asarray(class_ids[start:end], dtype=np.float64)
+            except (TypeError, ValueError):
+                return self.frame_ids[i]
+        return None
+
+    def frame(self, i):
+        # Views of frame i's detections (N x 5 boxes + score), class ids
+        # and class names
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return (self.detections[start:end], self.class_ids[start:end],
+                self.class_names[start:end])
+
+
+class TrackResults:
+    # Per-frame tracking records of a DetectionPayload as columns, one
+    # row per reported track plus one placeholder row (track_id None) for
+    # each frame reported without tracks, in frame order
+
+    def __init__(self, payload):
+        # Frame metadata of the payload, copied so extend() can add to it
+        self.request_ids = list(payload.request_ids)
+        self.frame_ids = list(payload.frame_ids)
+        self.timestamps = list(payload.timestamps)
+        self._frame_index = []
+        self._track_ids = []
+        self._boxes = []
+        self._confidences = []
+        self._class_ids = []
+        self._class_names = []
+        self._predicted = []
+
+    def add_placeholder(self, i):
+        self.add_tracks(i, [None], np.zeros((1, 4), dtype=np.int64), [None],
+                        [None], [None], False)
+
+    def add_tracks(self, i, track_ids, boxes, confidences, class_ids,
+                   class_names, predicted):
+        # boxes: K x 4 integer (x1, y1, x2, y2)
+        self._frame_index.append(np.full(len(track_ids), i, dtype=np.int64))
+        self._track_ids.extend(track_ids)
+        self._boxes.append(boxes)
+        self._confidences.extend(confidences)
+        self._class_ids.extend(class_ids)
+        self._class_names.extend(class_names)
+        self._predicted.append(np.full(len(track_ids), predicted))
+
+    def extend(self, other):
+        # Appends the frames and records of other, whose frames follow
+        # this one's (consecutive batches tracked by the same tracker)
+        offset = len(self.frame_ids)
+        self.request_ids.extend(other.request_ids)
+        self.frame_ids.extend(other.frame_ids)
+        self.timestamps.extend(other.timestamps)
+        self._frame_index.extend(frame_index + offset
+                                 for frame_index in other._frame_index)
+        self._track_ids.extend(other._track_ids)
+        self._boxes.extend(other._boxes)
+        self._confidences.extend(other._confidences)
+        self._class_ids.extend(other._class_ids)
+        self._class_names.extend(other._class_names)
+        self._predicted.extend(other._predicted)
+
+    def columns(self):
+        # (frame_index, track_ids, boxes, confidences, class_ids,
+        # class_names, predicted) over all rows
+        if not self._frame_index:
+            return (np.empty(0, dtype=np.int64), [], np.empty(
+                (0, 4), dtype=np.int64), [], [], [], np.empty(0, dtype=bool))
+        return (np.concatenate(self._frame_index), self._track_ids,
+                np.concatenate(self._boxes), self._confidences,
+                self._class_ids, self._class_names,
+                np.concatenate(self._predicted))
+
+    def __len__(self):
+        return len(self._track_ids)
+
+    def to_json(self):
+        # The records as a JSON array, the /track response body
+        frame_keys = [(dumps(frame_id), dumps(request_id), dumps(timestamp))
+                      for frame_id, request_id, timestamp in zip(
+                          self.frame_ids, self.request_ids, self.timestamps)]
+        # Class names and track IDs repeat across frames; encode each once
+        names = {}
+        ids = {}
+        records = []
+        (frame_index, track_ids, boxes, confidences, class_ids, class_names,
+         predicted) = self.columns()
+        for i, track_id, box, confidence, class_id, class_name, is_predicted \
+                in zip(frame_index.tolist(), track_ids, boxes.tolist(),
+                       confidences, class_ids, class_names,
+                       predicted.tolist()):
+            frame_id, request_id, timestamp = frame_keys[i]
+            if track_id is None:
+                records.append(_PLACEHOLDER % (frame_id, request_id,
+                                               timestamp))
+                continue
+            if class_name not in names:
+                names[class_name] = dumps(class_name)
+            if track_id not in ids:
+                ids[track_id] = dumps(track_id)
+            records.append(
+                _RECORD %
+                (box[0], box[2], box[1], box[3],
+                 'null' if class_id is None else class_id, names[class_name],
+                 confidence, frame_id, _PREDICTED if is_predicted else '',
+                 request_id, timestamp, ids[track_id]))
+        return '[' + ','.join(records) + ']'
+
+    def to_tracklets(self):
+        # The records as a tracklet document (see the format above)
+        frame_ids = self.frame_ids
+        (frame_index, track_ids, boxes, confidences, class_ids, class_names,
+         predicted) = self.columns()
+        # Rows of each track ID, tracks in order of first appearance
+        codes = {}
+        track_codes = np.array([
+            -1 if track_id is None else codes.setdefault(track_id, len(codes))
+            for track_id in track_ids
+        ],
+                               dtype=np.int64)
+        rows = np.flatnonzero(track_codes >= 0)
+        rows = rows[np.argsort(track_codes[rows], kind='stable')]
+        bounds = np.flatnonzero(np.diff(track_codes[rows])) + 1
+
+        tracklets = []
+        for track_rows in np.split(rows, bounds):
+            if len(track_rows) == 0:
+                continue
+            positions = frame_index[track_rows].tolist()
+            track_rows = track_rows.tolist()
+            first = track_rows[0]
+            tracklet = {
+                'track_id': track_ids[first],
+                'class_id': class_ids[first],
+                'class_name': class_names[first],
+                'start_frame': frame_ids[positions[0]],
+                'end_frame': frame_ids[positions[-1]],
+            }
+            if positions[-1] - positions[0] + 1 != len(positions):
+                tracklet['frame_ids'] = [frame_ids[p] for p in positions]
+            tracklet['boxes'] = boxes[track_rows].ravel().tolist()
+            tracklet['scores'] = [confidences[r] for r in track_rows]
+            predicted_frames = [
+                frame_ids[p] for p, r in zip(positions, track_rows)
+                if predicted[r]
+            ]
+            if predicted_frames:
+                tracklet['predicted'] = predicted_frames
+            class_changes = [[frame_ids[p], class_ids[r], class_names[r]]
+                             for p, r, previous in zip(
+                                 positions[1:], track_rows[1:], track_rows)
+                             if (class_ids[r], class_names[r]) !=
+                             (class_ids[previous], class_names[previous])]
+            if class_changes:
+                tracklet['class_changes'] = class_changes
+            tracklets.append(tracklet)
+
+        return {
+            'format': 'tracklets',
+            'request_id': self.request_ids[0] if self.request_ids else None,
+            'frames': [[frame_id, timestamp] for frame_id, timestamp in zip(
+                frame_ids, self.timestamps)],
+            'tracklets': tracklets,
+        }
+
+    def to_columns(self):
+        # The records as flat little-endian arrays, the MessagePack /track
+        # response: frame_ids (list) and timestamps (f8) per frame, then per
+        # record frame_index (i4, into frame_ids), track_ids (list), boxes
+        # (i4, x1 y1 x2 y2), confidences (f8), class_ids (i4), class_index
+        # (i4, into the class_names table) and predicted (bool). Class -1
+        # stands for null; frames without records had no tracks.
+        (frame_index, track_ids, boxes, confidences, class_ids, class_names,
+         predicted) = self.columns()
+        rows = np.array([
+            r for r, track_id in enumerate(track_ids) if track_id is not None
+        ],
+                        dtype=np.int64)
+        rows_list = rows.tolist()
+        table = {}
+        class_index = [
+            -1 if class_names[r] is None else table.setdefault(
+                class_names[r], len(table)) for r in rows_list
+        ]
+        return {
+            'format': 'track_columns',
+            'request_id': self.request_ids[0] if self.request_ids else None,
+            'frame_ids': self.frame_ids,
+            'timestamps': np.asarray(self.timestamps, dtype='<f8').tobytes(),
+            'frame_index': frame_index[rows].astype('<i4').tobytes(),
+            'track_ids': [track_ids[r] for r in rows_list],
+            'boxes': boxes[rows].astype('<i4').tobytes(),
+            'confidences': np.asarray([confidences[r] for r in rows_list],
+                                      dtype='<f8').tobytes(),
+            'class_ids': np.asarray([
+                -1 if class_ids[r] is None else class_ids[r]
+                for r in rows_list
+            ],
+                                    dtype='<i4').tobytes(),
+            'class_names': list(table),
+            'class_index': np.asarray(class_index, dtype='<i4').tobytes(),
+            'predicted': predicted[rows].tobytes()
+        }
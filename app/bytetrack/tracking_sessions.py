@@ -0,0 +1,89 @@
+# In-memory tracking sessions for the ByteTrack service. A session keeps
+# one tracker alive across requests so detections can be pushed in
+# batches as the detector produces them; sessions nobody has used for
+# idle_timeout seconds are evicted.
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class TrackingSession:
+
+    def __init__(self, session_id, tracker):
+        self.session_id = session_id
+        self.tracker = tracker
+        # Last class seen for each track, for frames reported at their
+        # predicted position
+        self.track_classes = {}
+        # Batches of one session are tracked one at a time, in order
+        self.lock = threading.Lock()
+        self.frame_count = 0
+        self.last_used = time.monotonic()
+
+
+class SessionStore:
+
+    def __init__(self, idle_timeout, max_sessions):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def open(self, tracker):
+        # New session owning tracker, or None when the store is full
+        self.evict_idle()
+        with self._lock:
+            if len(self._sessions) >= self.max_sessions:
+                return None
+            session = TrackingSession(uuid.uuid4().hex, tracker)
+            self._sessions[session.session_id] = session
+            return session
+
+    def get(self, session_id):
+        # Open session for session_id (refreshing its idle time), or None
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.monotonic()
+            return session
+
+    def close(self, session_id):
+        # Removes and returns the session, or None if it is not open
+        with self._lock:
+            return self._sessions.pop(session_id, None)
+
+    def evict_idle(self):
+        # Drop sessions idle for longer than idle_timeout, skipping any
+        # that are tracking a batch right now
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            expired = [
+                session_id
+                for session_id, session in self._sessions.items()
+                if session.last_used < cutoff and not session.lock.locked()
+            ]
+            for session_id in expired:
+                session = self._sessions.pop(session_id)
+                logger.info(f"Evicted idle tracking session {session_id} "
+                            f"after {session.frame_count} frames")
+        return expired
+
+    def start_reaper(self, interval):
+        # Background thread evicting idle sessions every interval seconds
+        def reap():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.evict_idle()
+                except Exception as e:
+                    logger.error(
+                        f"Failed to evict idle tracking sessions: {str(e)}")
+
+        threading.Thread(target=reap, daemon=True).start()
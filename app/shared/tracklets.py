@@ -0,0 +1,152 @@
+# Tracklet documents, ByteTrack's ?format=tracklets results layout (see
+# app/bytetrack/track_io.py), and conversion to and from the per-frame
+# records the rest of the pipeline reads. Shared by the updateDdb Lambda
+# (as a layer) and the video-annotation image.
+
+
+def is_tracklets(document):
+    # Whether parsed results are a tracklet document rather than a list
+    # of per-frame records
+    return isinstance(document, dict) and document.get('format') == 'tracklets'
+
+
+def placeholder_record(request_id, frame_id, timestamp):
+    # Per-frame record of a frame without tracks
+    return {
+        'request_id': request_id,
+        'frame_id': frame_id,
+        'timestamp': timestamp,
+        'track_id': None,
+        'box': [{
+            'x1': None,
+            'y1': None,
+            'x2': None,
+            'y2': None
+        }],
+        'confidence': None,
+        'class_id': None,
+        'class_name': None
+    }
+
+
+def _record_box(record):
+    # [x1, y1, x2, y2] of a per-frame record, or None without a full box
+    box = record.get('box')
+    if not box or not isinstance(box[0], dict):
+        return None
+    coords = [box[0].get(key) for key in ('x1', 'y1', 'x2', 'y2')]
+    if any(coord is None for coord in coords):
+        return None
+    return coords
+
+
+def tracklets_to_frames(document):
+    # Per-frame records, in frame order, from a ByteTrack tracklet
+    # document; frames no tracklet covers get a null placeholder record.
+    # Tracklets do not record the tracker's output order, so within a
+    # frame records come in order of each track's first appearance: the
+    # same records as the per-frame response, not necessarily the same list.
+    request_id = document.get('request_id')
+    frames = document['frames']
+    positions = {frame_id: i for i, (frame_id, _) in enumerate(frames)}
+    frame_results = [[] for _ in frames]
+    for tracklet in document['tracklets']:
+        frame_ids = tracklet.get('frame_ids')
+        if frame_ids is None:
+            frame_ids = [
+                frame_id for frame_id, _ in
+                frames[positions[tracklet['start_frame']]:
+                       positions[tracklet['end_frame']] + 1]
+            ]
+        predicted = set(tracklet.get('predicted', []))
+        class_changes = iter(tracklet.get('class_changes', []))
+        next_change = next(class_changes, None)
+        class_id, class_name = tracklet['class_id'], tracklet['class_name']
+        boxes, scores = tracklet['boxes'], tracklet['scores']
+        for k, frame_id in enumerate(frame_ids):
+            if next_change is not None and next_change[0] == frame_id:
+                _, class_id, class_name = next_change
+                next_change = next(class_changes, None)
+            x1, y1, x2, y2 = boxes[4 * k:4 * k + 4]
+            result = {
+                'request_id': request_id,
+                'frame_id': frame_id,
+                'timestamp': frames[positions[frame_id]][1],
+                'track_id': tracklet['track_id'],
+                'box': [{
+                    'x1': x1,
+                    'y1': y1,
+                    'x2': x2,
+                    'y2': y2
+                }],
+                'confidence': scores[k],
+                'class_id': class_id,
+                'class_name': class_name
+            }
+            if frame_id in predicted:
+                result['predicted'] = True
+            frame_results[positions[frame_id]].append(result)
+
+    results = []
+    for (frame_id, timestamp), records in zip(frames, frame_results):
+        results.extend(
+            records or [placeholder_record(request_id, frame_id, timestamp)])
+    return results
+
+
+def frames_to_tracklets(results):
+    # Tracklet document (ByteTrack's ?format=tracklets layout) from
+    # frame-ordered per-frame records
+    frames = []
+    positions = {}
+    tracklets = {}
+    track_classes = {}
+    for result in results:
+        frame_id = result['frame_id']
+        if frame_id not in positions:
+            positions[frame_id] = len(frames)
+            frames.append([frame_id, result.get('timestamp')])
+        track_id = result.get('track_id')
+        box = _record_box(result)
+        if track_id is None or box is None:
+            continue
+        track_class = [result.get('class_id'), result.get('class_name')]
+        tracklet = tracklets.get(track_id)
+        if tracklet is None:
+            tracklet = tracklets[track_id] = {
+                'track_id': track_id,
+                'class_id': track_class[0],
+                'class_name': track_class[1],
+                'start_frame': frame_id,
+                'end_frame': frame_id,
+                'frame_ids': [],
+                'boxes': [],
+                'scores': [],
+                'predicted': [],
+                'class_changes': []
+            }
+        elif track_class != track_classes[track_id]:
+            tracklet['class_changes'].append([frame_id, *track_class])
+        track_classes[track_id] = track_class
+        tracklet['end_frame'] = frame_id
+        tracklet['frame_ids'].append(frame_id)
+        tracklet['boxes'].extend(box)
+        tracklet['scores'].append(result.get('confidence'))
+        if result.get('predicted'):
+            tracklet['predicted'].append(frame_id)
+
+    for tracklet in tracklets.values():
+        # Frame lists of tracks without gaps are implied by start and end
+        if (positions[tracklet['end_frame']] -
+                positions[tracklet['start_frame']] + 1 == len(
+                    tracklet['frame_ids'])):
+            del tracklet['frame_ids']
+        for key in ('predicted', 'class_changes'):
+            if not tracklet[key]:
+                del tracklet[key]
+    return {
+        'format': 'tracklets',
+        'request_id': results[0].get('request_id') if results else None,
+        'frames': frames,
+        'tracklets': list(tracklets.values())
+    }
@@ -1,9 +1,11 @@
 # Main tracking service with cloud hosting - with AWS
 import cv2
+import importlib.util
 import requests
 import json
 import os
 import sys
+import time
 import boto3
 import logging
 
@@ -24,10 +26,41 @@ OUTPUT_BUCKET = os.environ.get('OUTPUT_BUCKET')
 YOLO_SERVICE_ENDPOINT = os.environ['YOLO_SERVICE_ENDPOINT']
 BYTETRACK_SERVICE_ENDPOINT = os.environ['BYTETRACK_SERVICE_ENDPOINT']
 
+# Ask YOLO for a streamed NDJSON response (one JSON line per frame)
+YOLO_STREAMING = os.environ.get('YOLO_STREAMING', 'true').lower() == 'true'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# 'msgpack' asks YOLO for its columnar MessagePack detections and hands
+# them to ByteTrack as received, without parsing them here; YOLO services
+# that do not support it answer in JSON. 'json' keeps JSON throughout.
+# msgpack takes precedence over YOLO_STREAMING: YOLO builds the whole
+# MessagePack body before sending it, so the segment's detections are
+# held in memory on both sides, as without streaming.
+WIRE_FORMAT = os.environ.get('WIRE_FORMAT', 'json')
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+# Layout of the per-segment results: 'frames' (one record per track per
+# frame) or 'tracklets' (one record per track ID, much smaller for long
+# segments); video-annotation and updateDdb read both
+RESULTS_FORMAT = os.environ.get('RESULTS_FORMAT', 'frames')
+
+# 'http' sends the segment to the YOLO service, then its detections to
+# the ByteTrack service. 'inprocess' imports both services as libraries
+# and detects and tracks in this process. 'compare' runs both on the
+# segment, logs their timings and keeps the HTTP results. The in-process
+# modes need the image built from Dockerfile.inprocess; this directory's
+# Dockerfile only supports 'http'.
+TRACKING_MODE = os.environ.get('TRACKING_MODE', 'http')
+TRACKING_MODES = ('http', 'inprocess', 'compare')
+IN_PROCESS_MODULES = ('yolov8_service', 'bytetrack_service', 'ultralytics',
+                      'yolox')
+# Frames handed to the tracker at a time in in-process mode
+TRACK_BATCH_SIZE = int(os.environ.get('TRACK_BATCH_SIZE', 32))
+
 # Temporary file paths
 TEMP_INPUT_VIDEO = '/tmp/input.mp4'
 TEMP_OUTPUT_VIDEO = '/tmp/output.mp4'
 TEMP_OUTPUT_JSON = '/tmp/output.json'
+TEMP_OUTPUT_STATE = '/tmp/output.state.json'
 
 # Initialize S3 client
 s3_client = boto3.client('s3')
@@ -50,6 +83,264 @@ def upload_to_s3(bucket_name, source_file_name, destination_blob_name):
     logger.info(f"Upload completed: {bucket_name}/{destination_blob_name}")
 
 
+def iter_detection_stream(response):
+    # Parse YOLO's NDJSON response line by line as frames arrive
+    for line in response.iter_lines():
+        if not line:
+            continue
+        record = json.loads(line)
+        if 'error' in record:
+            raise RuntimeError(f"YOLO service error: {record['error']}")
+        yield record
+
+
+def request_detections(request_data):
+    # Per-frame detection records, or the raw columnar MessagePack body
+    if WIRE_FORMAT == 'msgpack':
+        if YOLO_STREAMING:
+            logger.warning("WIRE_FORMAT=msgpack takes precedence over "
+                           "YOLO_STREAMING: detections are not streamed")
+        yolo_response = requests.post(f"{YOLO_SERVICE_ENDPOINT}/detect",
+                                      json=request_data,
+                                      headers={'Accept': MSGPACK_MIMETYPE})
+        yolo_response.raise_for_status()
+        # Older YOLO services ignore the Accept header and return JSON
+        content_type = yolo_response.headers.get('Content-Type', '')
+        if content_type.startswith(MSGPACK_MIMETYPE):
+            return yolo_response.content
+        return yolo_response.json()
+
+    if not YOLO_STREAMING:
+        yolo_response = requests.post(f"{YOLO_SERVICE_ENDPOINT}/detect",
+                                      json=request_data)
+        yolo_response.raise_for_status()
+        return yolo_response.json()
+
+    with requests.post(f"{YOLO_SERVICE_ENDPOINT}/detect",
+                       json=request_data,
+                       headers={'Accept': NDJSON_MIMETYPE},
+                       stream=True) as yolo_response:
+        yolo_response.raise_for_status()
+        # Older YOLO services ignore the Accept header and return JSON
+        content_type = yolo_response.headers.get('Content-Type', '')
+        if not content_type.startswith(NDJSON_MIMETYPE):
+            return yolo_response.json()
+
+        detection_results = []
+        for record in iter_detection_stream(yolo_response):
+            detection_results.append(record)
+            if len(detection_results) % 100 == 0:
+                logger.info(
+                    f"Received {len(detection_results)} frames from YOLO")
+        return detection_results
+
+
+def detect_and_track_over_http(request_data):
+    # Detection by the YOLO service, then tracking by the ByteTrack
+    # service. Returns (final_results, tracker_snapshot, timings).
+    timings = {}
+    try:
+        # Step 1: Send video to YOLO service for detection
+        logger.info("Sending video to YOLO service for detection")
+        start = time.perf_counter()
+        detection_results = request_detections(request_data)
+        timings['detect'] = time.perf_counter() - start
+        if isinstance(detection_results, bytes):
+            logger.info(f"YOLO detection completed. Received "
+                        f"{len(detection_results)} bytes of columnar "
+                        f"detections.")
+        else:
+            logger.info(
+                f"YOLO detection completed. Received {len(detection_results)} results."
+            )
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error connecting to YOLO service: {e}", exc_info=True)
+        sys.exit(1)
+    except Exception as e:
+        logger.error(f"Unexpected error in YOLO service: {e}", exc_info=True)
+        sys.exit(1)
+
+    try:
+        # Step 2: Send YOLO results to Bytetrack service for tracking
+        logger.info("Sending YOLO results to Bytetrack service for tracking")
+        # Also ask for the final tracker state, which video-annotation
+        # uses to stitch track IDs across segment boundaries
+        if isinstance(detection_results, bytes):
+            body = {
+                'data': detection_results,
+                'headers': {
+                    'Content-Type': MSGPACK_MIMETYPE
+                }
+            }
+        else:
+            body = {'json': detection_results}
+        start = time.perf_counter()
+        bytetrack_response = requests.post(
+            f"{BYTETRACK_SERVICE_ENDPOINT}/track",
+            params={
+                'snapshot': 'true',
+                'format': RESULTS_FORMAT
+            },
+            **body)
+        bytetrack_response.raise_for_status()
+        final_results = bytetrack_response.json()
+        tracker_snapshot = None
+        # Older Bytetrack services ignore snapshot and return the list
+        if isinstance(final_results, dict) and 'results' in final_results:
+            tracker_snapshot = final_results.get('snapshot')
+            final_results = final_results['results']
+        timings['track'] = time.perf_counter() - start
+        if isinstance(final_results, dict):
+            logger.info(f"Bytetrack tracking completed. Received "
+                        f"{len(final_results['tracklets'])} tracklets.")
+        else:
+            logger.info(
+                f"Bytetrack tracking completed. Received {len(final_results)} results."
+            )
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error connecting to Bytetrack service: {e}",
+                     exc_info=True)
+        sys.exit(1)
+    except Exception as e:
+        logger.error(f"Unexpected error in Bytetrack service: {e}",
+                     exc_info=True)
+        sys.exit(1)
+    return final_results, tracker_snapshot, timings
+
+
+def check_tracking_mode():
+    # Refuse an unknown mode, or an in-process mode in an image without
+    # the services, before any work is done
+    if TRACKING_MODE not in TRACKING_MODES:
+        raise ValueError(f"Unsupported TRACKING_MODE: {TRACKING_MODE}")
+    if TRACKING_MODE == 'http':
+        return
+    missing = [
+        name for name in IN_PROCESS_MODULES
+        if importlib.util.find_spec(name) is None
+    ]
+    if missing:
+        raise RuntimeError(
+            f"TRACKING_MODE={TRACKING_MODE} needs the YOLO and ByteTrack "
+            f"services in this image, but {', '.join(missing)} cannot be "
+            f"imported. Build the image from tracking-job/Dockerfile.inprocess "
+            f"or use TRACKING_MODE=http.")
+
+
+def load_in_process_models():
+    # Import the YOLO and ByteTrack services as libraries and load the
+    # detection model and tracker synchronously
+    import yolov8_service as detector
+    import bytetrack_service as tracker_service
+
+    detector.start_models()
+    if not detector.model_ready.is_set():
+        raise RuntimeError(f"YOLO model failed to load: "
+                           f"{detector.model_error}")
+    tracker_service.load_tracker()
+    if not tracker_service.tracker_ready.is_set():
+        raise RuntimeError(f"ByteTrack failed to load: "
+                           f"{tracker_service.tracker_error}")
+    return detector, tracker_service
+
+
+def detect_and_track_in_process():
+    # Decode, detect and track the segment in one loop inside this
+    # process: each TRACK_BATCH_SIZE frames go to the tracker as soon as
+    # YOLO has them, and detections are never serialized. Returns
+    # (final_results as a JSON string, tracker_snapshot, timings).
+    try:
+        start = time.perf_counter()
+        detector, tracker_service = load_in_process_models()
+        timings = {
+            'load': time.perf_counter() - start,
+            'detect': 0.0,
+            'track': 0.0
+        }
+
+        options = detector.parse_detect_options({})
+        tracker = tracker_service.BYTETracker(
+            tracker_service.BYTETrackerArgs(),
+            id_generator=tracker_service.TrackIdGenerator())
+        track_classes = {}
+        tracking_results = None
+
+        video_source, temp_input_video, content_digest = \
+            detector.fetch_segment(OUTPUT_BUCKET, INPUT_VIDEO)
+        try:
+            cache_key = (detector.detection_cache_key(content_digest, options)
+                         if detector.detection_cache else None)
+            stats = {}
+            records = detector.iter_cached_detections(video_source,
+                                                      REQUEST_ID,
+                                                      cache_key=cache_key,
+                                                      stats=stats,
+                                                      **options)
+            batch = []
+            while True:
+                start = time.perf_counter()
+                record = next(records, None)
+                timings['detect'] += time.perf_counter() - start
+                if record is not None:
+                    batch.append(record[detector.MODEL_NAME])
+                if batch and (record is None
+                              or len(batch) == TRACK_BATCH_SIZE):
+                    start = time.perf_counter()
+                    batch_results = tracker_service.track_frames(
+                        tracker, track_classes, batch)
+                    timings['track'] += time.perf_counter() - start
+                    if tracking_results is None:
+                        tracking_results = batch_results
+                    else:
+                        tracking_results.extend(batch_results)
+                    batch = []
+                if record is None:
+                    break
+            detector.log_detection_stats(REQUEST_ID, stats)
+        finally:
+            detector.remove_scratch_file(temp_input_video)
+
+        start = time.perf_counter()
+        if tracking_results is None:
+            final_results = '[]'
+        else:
+            final_results = tracker_service.serialize_results(
+                tracking_results, RESULTS_FORMAT)
+        tracker_snapshot = tracker_service.export_snapshot(
+            tracker, track_classes)
+        timings['serialize'] = time.perf_counter() - start
+        logger.info(f"In-process detection and tracking completed: "
+                    f"{len(tracking_results or [])} results.")
+    except Exception as e:
+        logger.error(f"Error in in-process detection and tracking: {e}",
+                     exc_info=True)
+        sys.exit(1)
+    return final_results, tracker_snapshot, timings
+
+
+def format_timings(timings):
+    return ', '.join(f"{phase} {seconds:.2f}s"
+                     for phase, seconds in timings.items())
+
+
+def compare_tracking_modes(http_results, http_timings):
+    # Run the in-process mode on the same segment and log both modes'
+    # timings and whether their results agree. Model loading is reported
+    # apart from the totals; it is paid once per job, like service startup.
+    in_process_results, _, in_process_timings = detect_and_track_in_process()
+    in_process_total = sum(seconds
+                           for phase, seconds in in_process_timings.items()
+                           if phase != 'load')
+    logger.info(f"HTTP mode: {format_timings(http_timings)}, "
+                f"total {sum(http_timings.values()):.2f}s")
+    logger.info(f"In-process mode: {format_timings(in_process_timings)}, "
+                f"total without load {in_process_total:.2f}s")
+    if json.loads(in_process_results) == http_results:
+        logger.info("In-process and HTTP results are identical")
+    else:
+        logger.warning("In-process and HTTP results differ")
+
+
 def read_metadata():
     with open('/tmp/metadata.json', 'r') as f:
         return json.load(f)
@@ -160,6 +451,7 @@ def process_video():
     )
     logger.info(f"YOLO_SERVICE_ENDPOINT: {YOLO_SERVICE_ENDPOINT}")
     logger.info(f"BYTETRACK_SERVICE_ENDPOINT: {BYTETRACK_SERVICE_ENDPOINT}")
+    logger.info(f"TRACKING_MODE: {TRACKING_MODE}")
     request_data = {
         "request_id": REQUEST_ID,
         "bucket_name": OUTPUT_BUCKET,
@@ -168,50 +460,33 @@ def process_video():
 
     try:
         print(f"Processing video: {INPUT_VIDEO}")
-
-        try:
-            # Step 1: Send video to YOLO service for detection
-            logger.info("Sending video to YOLO service for detection")
-            yolo_response = requests.post(f"{YOLO_SERVICE_ENDPOINT}/detect",
-                                          json=request_data)
-            yolo_response.raise_for_status()
-            detection_results = yolo_response.json()
-            logger.info(
-                f"YOLO detection completed. Received {len(detection_results)} results."
-            )
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error connecting to YOLO service: {e}",
-                         exc_info=True)
-            sys.exit(1)
-        except Exception as e:
-            logger.error(f"Unexpected error in YOLO service: {e}",
-                         exc_info=True)
-            sys.exit(1)
-
-        try:
-            # Step 2: Send YOLO results to Bytetrack service for tracking
-            logger.info(
-                "Sending YOLO results to Bytetrack service for tracking")
-            bytetrack_response = requests.post(
-                f"{BYTETRACK_SERVICE_ENDPOINT}/track", json=detection_results)
-            bytetrack_response.raise_for_status()
-            final_results = bytetrack_response.json()
-            logger.info(
-                f"Bytetrack tracking completed. Received {len(final_results)} results."
-            )
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error connecting to Bytetrack service: {e}",
-                         exc_info=True)
-            sys.exit(1)
-        except Exception as e:
-            logger.error(f"Unexpected error in Bytetrack service: {e}",
-                         exc_info=True)
-            sys.exit(1)
+        check_tracking_mode()
+
+        if TRACKING_MODE == 'inprocess':
+            final_results, tracker_snapshot, timings = \
+                detect_and_track_in_process()
+        else:
+            final_results, tracker_snapshot, timings = \
+                detect_and_track_over_http(request_data)
+            if TRACKING_MODE == 'compare':
+                compare_tracking_modes(final_results, timings)
+        logger.info(f"Detection and tracking ({TRACKING_MODE}): "
+                    f"{format_timings(timings)}")
 
         # Save final results to JSON file
         logger.info(f"Saving final results to {TEMP_OUTPUT_JSON}")
         with open(TEMP_OUTPUT_JSON, 'w') as f:
-            json.dump(final_results, f, indent=2)
+            if isinstance(final_results, str):
+                # Already serialized by the in-process tracker
+                f.write(final_results)
+            elif isinstance(final_results, dict):
+                # Indenting would put every box coordinate on its own line
+                json.dump(final_results, f)
+            else:
+                json.dump(final_results, f, indent=2)
+        if tracker_snapshot is not None:
+            with open(TEMP_OUTPUT_STATE, 'w') as f:
+                json.dump(tracker_snapshot, f)
 
         # Download input video from S3
         # logger.info(
@@ -242,6 +517,9 @@ def process_video():
         logger.info(
             f"Uploading output json to S3: {OUTPUT_BUCKET}/{output_json_path}")
         upload_to_s3(OUTPUT_BUCKET, TEMP_OUTPUT_JSON, output_json_path)
+        if tracker_snapshot is not None:
+            upload_to_s3(OUTPUT_BUCKET, TEMP_OUTPUT_STATE,
+                         output_json_path.rsplit('.', 1)[0] + '.state.json')
 
         return f"Processing complete. Output json stored in output bucket: {OUTPUT_BUCKET}/{output_json_path}/"
 
@@ -267,6 +545,8 @@ def process_video():
             os.remove(TEMP_OUTPUT_VIDEO)
         if os.path.exists(TEMP_OUTPUT_JSON):
             os.remove(TEMP_OUTPUT_JSON)
+        if os.path.exists(TEMP_OUTPUT_STATE):
+            os.remove(TEMP_OUTPUT_STATE)
 
 
 if __name__ == "__main__":
@@ -7,6 +7,9 @@ from botocore.exceptions import ClientError
 import logging
 from decimal import Decimal, InvalidOperation
 
+# Shipped in the shared Lambda layer (app/shared)
+from tracklets import is_tracklets, tracklets_to_frames
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -53,6 +56,8 @@ def handler(event, context):
                         Key=f"{request_id}/processed_chunks/{json_file}")
                     segment_data = json.loads(
                         json_obj['Body'].read().decode('utf-8'))
+                    if is_tracklets(segment_data):
+                        segment_data = tracklets_to_frames(segment_data)
                     logger.info(f"Segment data length: {len(segment_data)}")
 
                     total_items += len(segment_data)
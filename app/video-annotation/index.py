@@ -5,6 +5,8 @@ import os
 import logging
 from collections import defaultdict
 
+from tracklets import frames_to_tracklets, is_tracklets, tracklets_to_frames
+
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger()
@@ -15,6 +17,19 @@ REQUEST_ID = os.environ['REQUEST_ID']
 INPUT_BUCKET = os.environ['INPUT_BUCKET']
 OUTPUT_BUCKET = os.environ['OUTPUT_BUCKET']
 INPUT_VIDEO = os.environ['INPUT_VIDEO']
+# 'download' copies the original video to /tmp first, 'stream' decodes it
+# straight from a presigned S3 URL without a local copy
+S3_INPUT_MODE = os.environ.get('S3_INPUT_MODE', 'download')
+PRESIGNED_URL_EXPIRY = int(os.environ.get('PRESIGNED_URL_EXPIRY', 3600))
+# A track that ends in one segment continues a track that starts in the
+# next when they are at most STITCH_MAX_GAP frames apart, share a class,
+# and the first track's last box, moved along its tracker velocity, has
+# an IoU of at least STITCH_MIN_IOU with the second track's first box
+STITCH_MAX_GAP = int(os.environ.get('STITCH_MAX_GAP', 30))
+STITCH_MIN_IOU = float(os.environ.get('STITCH_MIN_IOU', 0.3))
+# Layout of final_results.json: 'frames' (one record per track per frame)
+# or 'tracklets' (one record per track, as ByteTrack's ?format=tracklets)
+RESULTS_FORMAT = os.environ.get('RESULTS_FORMAT', 'frames')
 
 
 def adjust_frame_and_timestamp(results, start_frame, start_time):
@@ -24,26 +39,141 @@ def adjust_frame_and_timestamp(results, start_frame, start_time):
     return results
 
 
-def reassign_track_ids(all_results):
-    track_id_map = {}
-    new_track_id = 1
-
-    # Sort all results by frame_id and timestamp
-    all_results.sort(key=lambda x: (x['frame_id'], x['timestamp']))
+def result_box(result):
+    # (x1, y1, x2, y2) of a result, or None if it has no complete box
+    box = result.get('box')
+    if not box or not isinstance(box[0], dict):
+        return None
+    coords = tuple(box[0].get(key) for key in ('x1', 'y1', 'x2', 'y2'))
+    if any(coord is None for coord in coords):
+        return None
+    return coords
+
+
+def box_iou(a, b):
+    iw = min(a[2], b[2]) - max(a[0], b[0])
+    ih = min(a[3], b[3]) - max(a[1], b[1])
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    intersection = iw * ih
+    union = ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) -
+             intersection)
+    return intersection / union if union > 0 else 0.0
+
+
+def track_ends(segment_results):
+    # First and last result of each track in a frame-ordered segment
+    first, last = {}, {}
+    for result in segment_results:
+        track_id = result['track_id']
+        if track_id is None or result_box(result) is None:
+            continue
+        first.setdefault(track_id, result)
+        last[track_id] = result
+    return first, last
+
+
+def track_velocities(snapshot):
+    # Per-frame (x, y) box velocity of each track in a tracker snapshot;
+    # the Kalman mean is (cx, cy, aspect, height) followed by velocities
+    if not snapshot:
+        return {}
+    return {
+        track['track_id']: (track['mean'][4], track['mean'][5])
+        for track in snapshot.get('tracks', [])
+    }
+
+
+def match_boundary(tails, velocities, heads):
+    # Pairs (tail track, head track) continuing each other across a
+    # segment boundary, best overlaps first, each track used at most once
+    candidates = []
+    for tail_id, tail in tails.items():
+        vx, vy = velocities.get(tail_id, (0.0, 0.0))
+        x1, y1, x2, y2 = result_box(tail)
+        for head_id, head in heads.items():
+            gap = head['frame_id'] - tail['frame_id']
+            if not 0 < gap <= STITCH_MAX_GAP:
+                continue
+            if (tail.get('class_id') is not None
+                    and head.get('class_id') is not None
+                    and tail['class_id'] != head['class_id']):
+                continue
+            predicted = (x1 + vx * gap, y1 + vy * gap, x2 + vx * gap,
+                         y2 + vy * gap)
+            iou = box_iou(predicted, result_box(head))
+            if iou >= STITCH_MIN_IOU:
+                candidates.append((iou, tail_id, head_id))
+
+    matches = []
+    used_tails, used_heads = set(), set()
+    for _, tail_id, head_id in sorted(candidates,
+                                      key=lambda c: c[0],
+                                      reverse=True):
+        if tail_id in used_tails or head_id in used_heads:
+            continue
+        used_tails.add(tail_id)
+        used_heads.add(head_id)
+        matches.append((tail_id, head_id))
+    return matches
+
+
+def stitch_track_ids(segments):
+    # Merge per-segment results, already frame-ordered and offset to
+    # global frame numbers, into one list with globally consistent track
+    # IDs numbered in order of first appearance. Each segment tracks with
+    # its own IDs, so IDs are only shared across a boundary when
+    # match_boundary() links the two tracks. One linear pass, no sort.
+    all_results = []
+    next_track_id = 1
+    previous = None
+    stitched = 0
+
+    for segment_results, snapshot in segments:
+        first, last = track_ends(segment_results)
+        track_id_map = {}
+        if previous is not None:
+            previous_last, previous_velocities, previous_map = previous
+            for tail_id, head_id in match_boundary(previous_last,
+                                                   previous_velocities,
+                                                   first):
+                track_id_map[head_id] = previous_map[tail_id]
+                stitched += 1
+
+        for result in segment_results:
+            original_track_id = result['track_id']
+            if original_track_id is not None:
+                if original_track_id not in track_id_map:
+                    track_id_map[original_track_id] = next_track_id
+                    next_track_id += 1
+                result['track_id'] = track_id_map[original_track_id]
+            all_results.append(result)
+
+        previous = (last, track_velocities(snapshot), track_id_map)
+
+    logger.info(f"Stitched {stitched} tracks across segment boundaries, "
+                f"{next_track_id - 1} tracks in total")
+    return all_results
 
-    for result in all_results:
-        original_track_id = result['track_id']
-        if original_track_id not in track_id_map:
-            track_id_map[original_track_id] = new_track_id
-            new_track_id += 1
-        result['track_id'] = track_id_map[original_track_id]
 
-    return all_results
+def load_tracker_snapshot(json_file):
+    # Final tracker state saved next to a segment's results, or None for
+    # segments tracked without one
+    state_file = json_file.rsplit('.', 1)[0] + '.state.json'
+    try:
+        state_obj = s3.get_object(
+            Bucket=OUTPUT_BUCKET,
+            Key=f"{REQUEST_ID}/processed_chunks/{state_file}")
+        return json.loads(state_obj['Body'].read().decode('utf-8'))
+    except Exception as e:
+        logger.info(f"No tracker snapshot for {json_file}: {str(e)}")
+        return None
 
 
 def process_json_files(manifest_data):
-    # Download and merge all JSON files listed in the manifest
-    all_results = []
+    # Download all JSON files listed in the manifest, as (results,
+    # tracker snapshot) per segment with global frame ids and timestamps
+    segments = []
     total_segments = len(manifest_data.get('segments', []))
     logger.info(f"Total segments in manifest: {total_segments}")
 
@@ -59,12 +189,15 @@ def process_json_files(manifest_data):
                 Bucket=OUTPUT_BUCKET,
                 Key=f"{REQUEST_ID}/processed_chunks/{json_file}")
             segment_data = json.loads(json_obj['Body'].read().decode('utf-8'))
+            if is_tracklets(segment_data):
+                segment_data = tracklets_to_frames(segment_data)
             logger.info(f"Segment data length: {len(segment_data)}")
 
             # Adjust frame_id and timestamp for this segment
             adjusted_segment_data = adjust_frame_and_timestamp(
                 segment_data, start_frame, start_time)
-            all_results.extend(adjusted_segment_data)
+            segments.append(
+                (adjusted_segment_data, load_tracker_snapshot(json_file)))
 
             # Update start_frame and start_time for the next segment
             if segment_data:
@@ -76,15 +209,17 @@ def process_json_files(manifest_data):
         except Exception as e:
             logger.error(f"Error processing JSON file {json_file}: {str(e)}")
 
-    return all_results
+    return segments
 
 
 def annotate_video(results_by_frame, input_path, output_path):
     # Annotate video
     logger.info("Starting video annotation")
-    cap = cv2.VideoCapture('/tmp/input.mp4')
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Failed to open input video: {INPUT_VIDEO}")
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter('/tmp/output.mp4', fourcc, cap.get(cv2.CAP_PROP_FPS),
+    out = cv2.VideoWriter(output_path, fourcc, cap.get(cv2.CAP_PROP_FPS),
                           (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
                            int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))))
 
@@ -150,10 +285,21 @@ def handler(event, context):
         logger.info(f"Starting video annotation for REQUEST_ID: {REQUEST_ID}")
         logger.info(f"Input video: {INPUT_VIDEO} from bucket: {INPUT_BUCKET}")
 
-        # Download original video
-        logger.info("Downloading original video")
-        s3.download_file(INPUT_BUCKET, INPUT_VIDEO, '/tmp/input.mp4')
-        logger.info("Original video downloaded successfully")
+        # Stream or download original video
+        if S3_INPUT_MODE == 'stream':
+            logger.info("Streaming original video from S3")
+            input_path = s3.generate_presigned_url(
+                'get_object',
+                Params={
+                    'Bucket': INPUT_BUCKET,
+                    'Key': INPUT_VIDEO
+                },
+                ExpiresIn=PRESIGNED_URL_EXPIRY)
+        else:
+            logger.info("Downloading original video")
+            s3.download_file(INPUT_BUCKET, INPUT_VIDEO, '/tmp/input.mp4')
+            logger.info("Original video downloaded successfully")
+            input_path = '/tmp/input.mp4'
 
         # Download and read manifest.json
         logger.info("Downloading manifest.json")
@@ -163,14 +309,18 @@ def handler(event, context):
         logger.info(f"Manifest data: {json.dumps(manifest_data)}")
 
         # Process JSON files
-        all_results = process_json_files(manifest_data)
+        segments = process_json_files(manifest_data)
 
-        # Reassign track IDs
-        all_results = reassign_track_ids(all_results)
+        # Merge segments with track IDs stitched across their boundaries
+        all_results = stitch_track_ids(segments)
 
         # Upload the re-processed and merged result file to S3
         logger.info("Saving and uploading final results")
-        final_results_json = json.dumps(all_results, indent=2)
+        if RESULTS_FORMAT == 'tracklets':
+            final_results_json = json.dumps(
+                frames_to_tracklets(all_results))
+        else:
+            final_results_json = json.dumps(all_results, indent=2)
 
         with open('/tmp/final_results.json', 'w') as f:
             f.write(final_results_json)
@@ -188,7 +338,7 @@ def handler(event, context):
             results_by_frame[result['frame_id']].append(result)
 
         # Annotate video
-        annotate_video(results_by_frame, '/tmp/input.mp4', '/tmp/output.mp4')
+        annotate_video(results_by_frame, input_path, '/tmp/output.mp4')
 
         # Upload annotated video
         logger.info("Uploading annotated video")
@@ -63,7 +63,8 @@ def split_video():
             os.makedirs(output_dir, exist_ok=True)
             logging.info(f"Created output directory: {output_dir}")
 
-            # Split video
+            # Split video. faststart puts each segment's moov atom up front so
+            # downstream jobs can decode segments progressively from S3.
             output_pattern = os.path.join(output_dir, "output%04d.mp4")
             segment_duration = SEGMENT_DURATION  # You can make this configurable if needed
 
@@ -73,6 +74,7 @@ def split_video():
                 str(segment_duration), '-reset_timestamps', '1', '-g', '50',
                 '-sc_threshold', '0', '-force_key_frames',
                 f'expr:gte(t,n_forced*{segment_duration})', '-f', 'segment',
+                '-segment_format_options', 'movflags=+faststart',
                 output_pattern
             ]
 
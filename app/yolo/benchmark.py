@@ -0,0 +1,171 @@
+# Throughput benchmark for the YOLO service - CPU only
+# Usage: python benchmark.py --video /path/to/segment.mp4
+#        python benchmark.py --video /path/to/segment.mp4 \
+#            --backends onnx openvino
+# Backend comparisons always run torch as the parity reference; the
+# parity assertions themselves are in test_backend_parity.py.
+import argparse
+import time
+import cv2
+import numpy as np
+
+from yolov8_service import (IMAGE_SIZE, MODEL_NAME, THRESHOLD,
+                            build_frame_result, decode_frames, load_model,
+                            warmup_model)
+
+# Minimum IoU for a backend's box to count as the same detection as the
+# torch box it is compared with
+PARITY_IOU = 0.5
+
+
+def load_frames(video_path, max_frames):
+    # Decode up front so only inference is timed
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    decoded_frames = decode_frames(cap)
+    for frame in decoded_frames:
+        frames.append(frame)
+        if len(frames) >= max_frames:
+            break
+    decoded_frames.close()
+    cap.release()
+    return frames[:max_frames]
+
+
+def run_inference(model, frames, batch_size):
+    # Returns per-frame detection records and the frames/sec achieved
+    records = []
+    start = time.perf_counter()
+    for i in range(0, len(frames), batch_size):
+        batch = frames[i:i + batch_size]
+        results = model.predict(source=batch,
+                                conf=float(THRESHOLD),
+                                imgsz=IMAGE_SIZE,
+                                task='detect',
+                                device='cpu',
+                                verbose=False)
+        for frame, frame_result in zip(batch, results):
+            records.append(
+                build_frame_result(frame_result, None, len(records), 1,
+                                   frame.shape))
+    elapsed = time.perf_counter() - start
+    return records, len(frames) / elapsed
+
+
+def box_iou(expected, actual):
+    # Pairwise IoU of two lists of xyxy boxes
+    a = np.asarray(expected, dtype=float).reshape(-1, 4)
+    b = np.asarray(actual, dtype=float).reshape(-1, 4)
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return intersection / np.maximum(union, 1e-9)
+
+
+def match_detections(expected, actual, iou_threshold=PARITY_IOU):
+    # Pair each expected box with the actual box it overlaps most, best
+    # pairs first, so backends that return the same detections in a
+    # different NMS order still line up. Returns (expected, actual) index
+    # pairs; boxes overlapping nothing above iou_threshold stay unpaired.
+    if not expected or not actual:
+        return []
+    iou = box_iou(expected, actual)
+    pairs = []
+    used_expected, used_actual = set(), set()
+    for flat in np.argsort(-iou, axis=None):
+        i, j = np.unravel_index(flat, iou.shape)
+        if iou[i, j] < iou_threshold:
+            break
+        if i in used_expected or j in used_actual:
+            continue
+        used_expected.add(i)
+        used_actual.add(j)
+        pairs.append((int(i), int(j)))
+    return pairs
+
+
+def compare_records(reference, candidate):
+    # Box/class parity of a backend against the torch reference, with
+    # detections matched by IoU. Box differences are only measured
+    # between matched detections of the same class.
+    stats = {
+        'count_mismatches': 0,
+        'unmatched': 0,
+        'class_mismatches': 0,
+        'max_box_diff': 0.0
+    }
+    for expected, actual in zip(reference, candidate):
+        if len(expected['box']) != len(actual['box']):
+            stats['count_mismatches'] += 1
+        pairs = match_detections(expected['box'], actual['box'])
+        stats['unmatched'] += (len(expected['box']) + len(actual['box']) -
+                               2 * len(pairs))
+        for i, j in pairs:
+            if expected['class_name'][i] != actual['class_name'][j]:
+                stats['class_mismatches'] += 1
+                continue
+            diff = np.abs(
+                np.array(expected['box'][i]) - np.array(actual['box'][j]))
+            stats['max_box_diff'] = max(stats['max_box_diff'],
+                                        float(diff.max()))
+    return stats
+
+
+def benchmark_batch_sizes(frames, batch_sizes):
+    model = load_model(MODEL_NAME)
+    warmup_model(model)
+    print(f"Benchmarking {MODEL_NAME} on {len(frames)} frames (CPU)")
+    for batch_size in batch_sizes:
+        _, fps = run_inference(model, frames, batch_size)
+        print(f"batch_size={batch_size:<3} {fps:8.2f} frames/sec")
+
+
+def benchmark_backends(frames, backends, batch_size):
+    # torch is always run, first, as the parity reference
+    print(f"Comparing backends on {len(frames)} frames "
+          f"(CPU, batch_size={batch_size})")
+    reference = None
+    for backend in ['torch'] + [b for b in backends if b != 'torch']:
+        model = load_model(MODEL_NAME, backend=backend)
+        warmup_model(model)
+        records, fps = run_inference(model, frames, batch_size)
+        line = f"{backend:<9} {fps:8.2f} frames/sec"
+        if reference is None:
+            reference = records
+            line += "  (parity reference)"
+        else:
+            stats = compare_records(reference, records)
+            line += (f"  frames with different box count: "
+                     f"{stats['count_mismatches']}, "
+                     f"unmatched boxes: {stats['unmatched']}, "
+                     f"class mismatches: {stats['class_mismatches']}, "
+                     f"max box diff: {stats['max_box_diff']:.2f}px")
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--video', required=True)
+    parser.add_argument('--frames', type=int, default=128)
+    parser.add_argument('--batch-sizes',
+                        type=int,
+                        nargs='+',
+                        default=[1, 4, 8, 16])
+    parser.add_argument('--backends', nargs='+')
+    args = parser.parse_args()
+
+    frames = load_frames(args.video, args.frames)
+    if not frames:
+        raise SystemExit(f"No frames decoded from {args.video}")
+
+    if args.backends:
+        benchmark_backends(frames, args.backends, args.batch_sizes[-1])
+    else:
+        benchmark_batch_sizes(frames, args.batch_sizes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+# Content-addressed cache of per-frame detection records for the YOLO
+# service. Entries are gzipped NDJSON files keyed on a hash of the
+# segment content and every setting that changes detection output.
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(json.dumps(part, sort_keys=True).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    # sha256 of a local file's bytes
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CacheWriter:
+    # Streams records into a temporary entry that only becomes visible
+    # in the cache on commit()
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.temp_path = os.path.join(cache.cache_dir,
+                                      f".{key}.{uuid.uuid4().hex}.tmp")
+        self.file = gzip.open(self.temp_path, 'wt', encoding='utf-8')
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+
+    def commit(self):
+        self.file.close()
+        self.cache._commit(self.key, self.temp_path)
+        self.temp_path = None
+
+    def abort(self):
+        if self.temp_path is None:
+            return
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+        self.temp_path = None
+
+
+class DetectionCache:
+    # Local-disk tier with size-bounded LRU eviction (file mtime is the
+    # recency), plus an optional S3 tier shared by every pod
+
+    def __init__(self,
+                 cache_dir,
+                 max_bytes,
+                 s3_client=None,
+                 bucket=None,
+                 prefix='detection-cache/'):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._stats = {'local_hits': 0, 's3_hits': 0, 'misses': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.ndjson.gz")
+
+    def _count(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def get(self, key):
+        # Open (binary) file of the local entry for key, fetching it from
+        # S3 if needed, or None on a miss. Workers sharing the directory
+        # may evict the entry at any time; an open file stays readable
+        # after that, so a hit can never fail half way.
+        path = self._path(key)
+        try:
+            entry = open(path, 'rb')
+        except FileNotFoundError:
+            entry = None
+        if entry is not None:
+            try:
+                # Refresh recency for LRU eviction
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+            self._count('local_hits')
+            return entry
+
+        if self.bucket:
+            temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                self.s3_client.download_file(self.bucket,
+                                             f"{self.prefix}{key}.ndjson.gz",
+                                             temp_path)
+                entry = open(temp_path, 'rb')
+                os.replace(temp_path, path)
+                self._evict()
+                self._count('s3_hits')
+                return entry
+            except Exception as e:
+                logger.debug(f"Detection cache S3 miss for {key}: {str(e)}")
+                if entry is not None:
+                    entry.close()
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+        self._count('misses')
+        return None
+
+    def iter_records(self, entry):
+        # Records of an entry opened by get(); closes it when done
+        with entry, gzip.open(entry, 'rt', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def writer(self, key):
+        return CacheWriter(self, key)
+
+    def _commit(self, key, temp_path):
+        path = self._path(key)
+        os.replace(temp_path, path)
+        if self.bucket:
+            try:
+                self.s3_client.upload_file(path, self.bucket,
+                                           f"{self.prefix}{key}.ndjson.gz")
+            except Exception as e:
+                logger.error(
+                    f"Failed to upload detection cache entry {key}: {str(e)}")
+        self._evict()
+
+    def _evict(self):
+        # Drop least recently used entries until under max_bytes
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.ndjson.gz'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+                total_bytes -= size
+            except FileNotFoundError:
+                continue
@@ -0,0 +1,30 @@
+# Gunicorn settings for the YOLO service
+import multiprocessing
+import os
+
+bind = '0.0.0.0:5000'
+
+# One model per worker process: the app is imported after fork, so each
+# worker loads its own copy of the model
+workers = int(os.environ.get('YOLO_WORKERS', multiprocessing.cpu_count()))
+preload_app = False
+
+# Concurrent requests within a worker share its InferenceScheduler, which
+# merges their frames into common predict batches
+threads = int(os.environ.get('YOLO_THREADS', 4))
+
+# Split the CPU cores between workers so torch does not oversubscribe them
+os.environ.setdefault('OMP_NUM_THREADS',
+                      str(max(1, multiprocessing.cpu_count() // workers)))
+
+# A segment can take much longer than gunicorn's default 30s to process
+timeout = int(os.environ.get('YOLO_WORKER_TIMEOUT', 300))
+
+accesslog = '-'
+
+
+def post_worker_init(worker):
+    # Load the models in the background so the worker can answer health
+    # checks immediately; /ready turns healthy once warmup has finished
+    import yolov8_service
+    yolov8_service.start_models_in_background()
@@ -0,0 +1,79 @@
+# Parity of the onnx and openvino backends against torch, the reference
+# backend, on a short clip. Backends whose runtime is not installed are
+# skipped. Usage (from app/yolo): python -m pytest test_backend_parity.py
+import importlib.util
+import cv2
+import pytest
+
+pytest.importorskip('ultralytics')
+
+import benchmark  # noqa: E402
+import yolov8_service  # noqa: E402
+
+# Largest coordinate difference, in source pixels, allowed between a
+# backend's box and the torch box it is matched with
+BOX_TOLERANCE_PX = 2.0
+CLIP_FRAMES = 16
+CLIP_SIZE = (640, 480)
+BATCH_SIZE = 4
+# Packages each exported backend needs to export and to run
+BACKEND_PACKAGES = {
+    'onnx': ('onnx', 'onnxruntime'),
+    'openvino': ('openvino', )
+}
+
+
+@pytest.fixture(scope='module')
+def clip_frames(tmp_path_factory):
+    # Pan across the sample images ultralytics ships so the clip has real
+    # detections, and decode it the way the service does
+    from ultralytics.utils import ASSETS
+
+    path = str(tmp_path_factory.mktemp('clip') / 'clip.mp4')
+    width, height = CLIP_SIZE
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 10,
+                             CLIP_SIZE)
+    for name in ('bus.jpg', 'zidane.jpg'):
+        image = cv2.resize(cv2.imread(str(ASSETS / name)),
+                           (width + 80, height + 60))
+        for step in range(CLIP_FRAMES // 2):
+            offset = step * 8
+            writer.write(image[offset:offset + height,
+                               offset:offset + width])
+    writer.release()
+
+    frames = benchmark.load_frames(path, CLIP_FRAMES)
+    assert len(frames) == CLIP_FRAMES
+    return frames
+
+
+@pytest.fixture(scope='module')
+def torch_records(clip_frames):
+    model = yolov8_service.load_model(yolov8_service.MODEL_NAME,
+                                      backend='torch')
+    records, _ = benchmark.run_inference(model, clip_frames, BATCH_SIZE)
+    assert any(record['box'] for record in records)
+    return records
+
+
+@pytest.mark.parametrize('backend', sorted(BACKEND_PACKAGES))
+def test_backend_matches_torch(backend, clip_frames, torch_records,
+                               tmp_path, monkeypatch):
+    missing = [
+        name for name in BACKEND_PACKAGES[backend]
+        if importlib.util.find_spec(name) is None
+    ]
+    if missing:
+        pytest.skip(f"{backend} backend needs {', '.join(missing)}")
+    # Export into a scratch cache, at full precision
+    monkeypatch.setattr(yolov8_service, 'MODEL_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(yolov8_service, 'YOLO_INT8', False)
+    model = yolov8_service.load_model(yolov8_service.MODEL_NAME,
+                                      backend=backend)
+    records, _ = benchmark.run_inference(model, clip_frames, BATCH_SIZE)
+
+    stats = benchmark.compare_records(torch_records, records)
+    assert stats['count_mismatches'] == 0
+    assert stats['unmatched'] == 0
+    assert stats['class_mismatches'] == 0
+    assert stats['max_box_diff'] <= BOX_TOLERANCE_PX
@@ -1,26 +1,890 @@
 # Yolo service job - with AWS
 import flask
-import ultralytics
 import cv2
 import os
+import json
+import math
+import time
+import queue
+import threading
+import contextlib
+from concurrent.futures import Future, ThreadPoolExecutor
+import fcntl
+import shutil
+import subprocess
+import tempfile
+import uuid
 import boto3
 import logging
+import msgpack
+import numpy as np
+
+from detection_cache import DetectionCache, file_digest, make_cache_key
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = flask.Flask(__name__)
-model = ultralytics.YOLO('yolov8n.pt')
+MODEL_NAME = os.environ.get('MODEL_NAME', 'yolov8n.pt')
+# Further models requests may ask for by name with 'models', e.g.
+# 'custom.pt,yolov8s.pt'. Every worker loads MODEL_NAME and these once at
+# startup; requests that name no models get MODEL_NAME only.
+EXTRA_MODELS = [
+    name.strip() for name in os.environ.get('EXTRA_MODELS', '').split(',')
+    if name.strip() and name.strip() != MODEL_NAME
+]
+AVAILABLE_MODELS = [MODEL_NAME] + EXTRA_MODELS
 THRESHOLD = '0.5'
+# Inference backend: 'torch' runs the .pt model in PyTorch eager mode,
+# 'onnx' and 'openvino' run a model exported once into MODEL_CACHE_DIR
+YOLO_BACKEND = os.environ.get('YOLO_BACKEND', 'torch')
+# INT8 post-training quantization, supported by the openvino backend only
+YOLO_INT8 = os.environ.get('YOLO_INT8', 'false').lower() == 'true'
+MODEL_CACHE_DIR = os.environ.get('MODEL_CACHE_DIR', '/app/model_cache')
+IMAGE_SIZE = int(os.environ.get('IMAGE_SIZE', 640))
+# Number of decoded frames sent to model.predict in a single call
+BATCH_SIZE = int(os.environ.get('BATCH_SIZE', 8))
+# Max decoded frames buffered ahead of inference by the decoder thread
+FRAME_QUEUE_SIZE = int(os.environ.get('FRAME_QUEUE_SIZE', 32))
+# Shared batching across concurrent requests: frames from all in-flight
+# requests are merged into one predict call of up to MAX_BATCH_SIZE frames,
+# waiting at most MAX_WAIT_MS for other requests to contribute frames
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 32))
+MAX_WAIT_MS = float(os.environ.get('MAX_WAIT_MS', 10))
+
+# Per-request downloads go here under a unique name so concurrent
+# requests served by the same pod never overwrite each other's input
+SCRATCH_DIR = os.environ.get('SCRATCH_DIR', tempfile.gettempdir())
+# 'download' copies the segment to SCRATCH_DIR before decoding, 'stream'
+# hands the decoder a presigned S3 URL so decoding starts on the first
+# bytes received and no local copy is written
+S3_INPUT_MODE = os.environ.get('S3_INPUT_MODE', 'download')
+PRESIGNED_URL_EXPIRY = int(os.environ.get('PRESIGNED_URL_EXPIRY', 3600))
+# Decode frames scaled down to the model input size (long side
+# IMAGE_SIZE) with ffmpeg instead of at full source resolution. Boxes are
+# mapped back to source coordinates and 'shape' reports the source size.
+PROXY_DECODE = os.environ.get('PROXY_DECODE', 'false').lower() == 'true'
+# Run YOLO on every FRAME_STRIDE-th frame only (overridable per request
+# with 'frame_stride'). Skipped frames still get a record, with empty
+# detections and 'detected': False, so the tracker can fill them in.
+FRAME_STRIDE = int(os.environ.get('FRAME_STRIDE', 1))
+# Motion gate: frames whose mean absolute difference (0-255, on a
+# 64x64 grayscale thumbnail) from the last inferred frame is below
+# MOTION_THRESHOLD reuse that frame's detections instead of running the
+# model. 0 disables the gate; overridable per request with
+# 'motion_threshold'.
+MOTION_THRESHOLD = float(os.environ.get('MOTION_THRESHOLD', 0))
+MOTION_THUMBNAIL_SIZE = (64, 64)
+# Detection cache keyed on segment content + model settings. The local
+# tier lives in DETECTION_CACHE_DIR (empty disables the cache) and is
+# LRU-evicted above DETECTION_CACHE_MAX_BYTES; DETECTION_CACHE_BUCKET adds
+# an S3 tier shared across pods.
+DETECTION_CACHE_DIR = os.environ.get(
+    'DETECTION_CACHE_DIR', os.path.join(SCRATCH_DIR, 'detection_cache'))
+DETECTION_CACHE_MAX_BYTES = int(
+    os.environ.get('DETECTION_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+DETECTION_CACHE_BUCKET = os.environ.get('DETECTION_CACHE_BUCKET')
+# Segments processed concurrently by one /detect_batch request
+DETECT_BATCH_WORKERS = int(os.environ.get('DETECT_BATCH_WORKERS', 4))
+# How long /detect waits for a worker's model to finish loading
+MODEL_READY_TIMEOUT = float(os.environ.get('MODEL_READY_TIMEOUT', 300))
+# Accept header that switches /detect to a streamed NDJSON response
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# Accept header that switches /detect to the columnar MessagePack format
+# (see columnar_detections), which ByteTrack's /track reads directly
+MSGPACK_MIMETYPE = 'application/x-msgpack'
 
 s3_client = boto3.client('s3')
 
+detection_cache = DetectionCache(
+    DETECTION_CACHE_DIR,
+    DETECTION_CACHE_MAX_BYTES,
+    s3_client=s3_client,
+    bucket=DETECTION_CACHE_BUCKET) if DETECTION_CACHE_DIR else None
+
+
+class DetectionError(Exception):
+    # Raised by iter_detections with a message safe to return to the caller
+    pass
+
+
+# Name ultralytics uses to recognise each exported model format
+EXPORT_SUFFIXES = {'onnx': '.onnx', 'openvino': '_openvino_model'}
+
+
+def load_model(model_name, backend=YOLO_BACKEND):
+    # Load model_name for the given backend. Non-torch backends export the
+    # model on first use and reuse the cached export on later starts.
+    # ultralytics (and torch with it) is imported here rather than at
+    # module import so the server can start answering before it loads.
+    import ultralytics
+
+    if backend == 'torch':
+        return ultralytics.YOLO(model_name)
+    if backend not in EXPORT_SUFFIXES:
+        raise ValueError(f"Unsupported YOLO_BACKEND: {backend}")
+
+    stem = os.path.splitext(os.path.basename(model_name))[0]
+    quantized = '_int8' if YOLO_INT8 and backend == 'openvino' else ''
+    cached_model = os.path.join(
+        MODEL_CACHE_DIR, f"{stem}{quantized}{EXPORT_SUFFIXES[backend]}")
+
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    # Workers start together, so only one of them runs the export
+    with open(os.path.join(MODEL_CACHE_DIR, '.export.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.exists(cached_model):
+            logger.info(f"Exporting {model_name} to {backend}: {cached_model}")
+            exported = ultralytics.YOLO(model_name).export(
+                format=backend,
+                imgsz=IMAGE_SIZE,
+                int8=bool(quantized),
+                dynamic=True)
+            shutil.move(exported, cached_model)
+    return ultralytics.YOLO(cached_model, task='detect')
+
+
+def warmup_model(model):
+    # Run one inference so the first request does not pay for lazy setup
+    blank_frame = np.zeros((IMAGE_SIZE, IMAGE_SIZE, 3), dtype=np.uint8)
+    model.predict(source=[blank_frame],
+                  conf=float(THRESHOLD),
+                  imgsz=IMAGE_SIZE,
+                  task='detect',
+                  verbose=False)
+
+
+class InferenceScheduler:
+    # Runs model.predict on a single thread for every request in this
+    # worker, batching frames submitted by concurrent requests together
+
+    def __init__(self, model, max_batch_size, max_wait_ms):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._carry = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._thread = None
+
+    @contextlib.contextmanager
+    def request(self):
+        # Track in-flight requests so a lone request never waits for others
+        with self._lock:
+            self._in_flight += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                daemon=True)
+                self._thread.start()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def submit(self, frames):
+        # Queue frames for inference; the Future resolves to their results
+        future = Future()
+        if not frames:
+            future.set_result([])
+            return future
+        self._queue.put((frames, future))
+        return future
+
+    def predict(self, frames):
+        # Block until the batch containing these frames has been inferred
+        return self.submit(frames).result()
+
+    def _next_item(self, timeout=None):
+        if self._carry is not None:
+            item, self._carry = self._carry, None
+            return item
+        return self._queue.get(timeout=timeout)
+
+    def _collect(self):
+        items = [self._next_item()]
+        size = len(items[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            # Dispatch now if every in-flight request is already in the batch
+            if len(items) >= self._in_flight:
+                break
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._next_item(timeout=timeout)
+            except queue.Empty:
+                break
+            if size + len(item[0]) > self.max_batch_size:
+                self._carry = item
+                break
+            items.append(item)
+            size += len(item[0])
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            frames = [
+                frame for item_frames, _ in items for frame in item_frames
+            ]
+            try:
+                results = self.model.predict(source=frames,
+                                             conf=float(THRESHOLD),
+                                             imgsz=IMAGE_SIZE,
+                                             task='detect')
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+
+            # Hand each request back the results for its own frames
+            offset = 0
+            for item_frames, future in items:
+                future.set_result(results[offset:offset + len(item_frames)])
+                offset += len(item_frames)
+
+
+# One scheduler per available model, shared by every request in this
+# worker. Models are attached once start_models() has loaded and warmed
+# them up; /ready reports healthy only after that.
+schedulers = {
+    name: InferenceScheduler(None, MAX_BATCH_SIZE, MAX_WAIT_MS)
+    for name in AVAILABLE_MODELS
+}
+model_ready = threading.Event()
+model_error = None
+
+
+def start_models():
+    # Import, load and warm up every model, logging each startup phase
+    global model_error
+    model_name = MODEL_NAME
+    try:
+        phase_start = startup_start = time.perf_counter()
+        import ultralytics  # noqa: F401
+        logger.info(f"Imported ultralytics in "
+                    f"{time.perf_counter() - phase_start:.2f}s")
+
+        for model_name in AVAILABLE_MODELS:
+            phase_start = time.perf_counter()
+            model = load_model(model_name)
+            load_seconds = time.perf_counter() - phase_start
+
+            phase_start = time.perf_counter()
+            warmup_model(model)
+            warmup_seconds = time.perf_counter() - phase_start
+
+            schedulers[model_name].model = model
+            logger.info(f"Model {model_name} ({YOLO_BACKEND}) loaded in "
+                        f"{load_seconds:.2f}s, warmup {warmup_seconds:.2f}s")
+
+        model_ready.set()
+        logger.info(f"{len(AVAILABLE_MODELS)} model(s) ready in "
+                    f"{time.perf_counter() - startup_start:.2f}s")
+    except Exception as e:
+        model_error = str(e)
+        logger.error(f"Failed to load model {model_name}: {str(e)}",
+                     exc_info=True)
+
+
+def start_models_in_background():
+    threading.Thread(target=start_models, daemon=True).start()
+
+
+def model_not_ready_response():
+    # 503 response if the model is not ready in time, otherwise None
+    if model_ready.wait(timeout=MODEL_READY_TIMEOUT):
+        return None
+    return flask.jsonify({
+        'error':
+        f'Model is not ready: {model_error or "still loading"}'
+    }), 503
+
+
+def presign_video(bucket_name, object_name):
+    # Returns a presigned URL and the object's ETag. The HEAD request also
+    # fails fast on a missing object rather than on an unopenable stream.
+    head = s3_client.head_object(Bucket=bucket_name, Key=object_name)
+    url = s3_client.generate_presigned_url('get_object',
+                                           Params={
+                                               'Bucket': bucket_name,
+                                               'Key': object_name
+                                           },
+                                           ExpiresIn=PRESIGNED_URL_EXPIRY)
+    return url, head['ETag']
+
+
+def remove_scratch_file(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+class ProxyCapture:
+    # cv2.VideoCapture look-alike that decodes through an ffmpeg pipe with
+    # the scale filter applied, so full-resolution frames are never
+    # materialised in Python
+
+    def __init__(self, video_source, max_side):
+        ffprobe_command = [
+            'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+            '-show_entries', 'stream=width,height,avg_frame_rate', '-of',
+            'json', video_source
+        ]
+        probe = subprocess.run(ffprobe_command,
+                               check=True,
+                               capture_output=True,
+                               text=True)
+        stream = json.loads(probe.stdout)['streams'][0]
+        self.width = int(stream['width'])
+        self.height = int(stream['height'])
+        num, den = stream['avg_frame_rate'].split('/')
+        self.fps = float(num) / float(den) if float(den) else 0.0
+
+        # Keep the aspect ratio and even dimensions for the scaler
+        scale = min(1.0, max_side / max(self.width, self.height))
+        self.proxy_width = max(2, int(self.width * scale / 2) * 2)
+        self.proxy_height = max(2, int(self.height * scale / 2) * 2)
+        self.source_shape = (self.height, self.width, 3)
+        self.frame_bytes = self.proxy_width * self.proxy_height * 3
+
+        ffmpeg_command = [
+            'ffmpeg', '-v', 'error', '-i', video_source, '-vf',
+            f'scale={self.proxy_width}:{self.proxy_height}', '-f',
+            'rawvideo', '-pix_fmt', 'bgr24', '-'
+        ]
+        self.process = subprocess.Popen(ffmpeg_command,
+                                        stdout=subprocess.PIPE)
+
+    def isOpened(self):
+        return self.process is not None
+
+    def read(self):
+        data = self.process.stdout.read(self.frame_bytes)
+        if len(data) < self.frame_bytes:
+            return False, None
+        frame = np.frombuffer(data, dtype=np.uint8)
+        return True, frame.reshape(self.proxy_height, self.proxy_width, 3)
+
+    def get(self, prop):
+        return {
+            cv2.CAP_PROP_FPS: self.fps,
+            cv2.CAP_PROP_FRAME_WIDTH: self.width,
+            cv2.CAP_PROP_FRAME_HEIGHT: self.height
+        }.get(prop, 0)
+
+    def release(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process.stdout.close()
+            self.process = None
+
+
+def open_capture(video_source):
+    if PROXY_DECODE:
+        return ProxyCapture(video_source, IMAGE_SIZE)
+    return cv2.VideoCapture(video_source)
+
+
+def decode_frames(cap, queue_size=FRAME_QUEUE_SIZE):
+    # Decode frames on a producer thread so decoding overlaps inference.
+    # The bounded queue applies backpressure when inference falls behind,
+    # and closing the generator stops the producer before returning.
+    frame_queue = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    end_of_stream = object()
+
+    def put(item):
+        while not stop_event.is_set():
+            try:
+                frame_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            while cap.isOpened():
+                ret, frame = cap.read()
+                if not ret or not put(frame):
+                    break
+        except Exception as e:
+            logger.error(f"Decoder thread failed: {str(e)}", exc_info=True)
+            put(e)
+        finally:
+            put(end_of_stream)
+
+    decoder = threading.Thread(target=producer, daemon=True)
+    decoder.start()
+    try:
+        while True:
+            item = frame_queue.get()
+            if item is end_of_stream:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop_event.set()
+        decoder.join()
+
+
+def read_batches(frames, batch_size):
+    # Group an iterable of frames into lists of up to batch_size frames
+    batch = []
+    for frame in frames:
+        batch.append(frame)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def build_frame_result(frame_result,
+                       request_id,
+                       frame_id,
+                       fps,
+                       frame_shape,
+                       source_shape=None):
+    # Convert one ultralytics result into the per-frame detection record.
+    # Boxes from a proxy-decoded frame are scaled back to source_shape.
+    boxes = frame_result.boxes.xyxy.tolist()
+    if source_shape is not None and source_shape != frame_shape:
+        scale_x = source_shape[1] / frame_shape[1]
+        scale_y = source_shape[0] / frame_shape[0]
+        boxes = [[x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y]
+                 for x1, y1, x2, y2 in boxes]
+        frame_shape = source_shape
+    height, width, channels = frame_shape
+    class_ids = frame_result.boxes.cls.tolist()
+    return {
+        "request_id": request_id,
+        "frame_id": frame_id,
+        "timestamp": frame_id / fps,
+        'shape': f"{height},{width},{channels}",
+        'box': boxes,
+        'confidence': frame_result.boxes.conf.tolist(),
+        'class_id': class_ids,
+        'class_name': [frame_result.names[int(id)] for id in class_ids]
+    }
+
+
+def build_skipped_frame_result(request_id, frame_id, fps, frame_shape):
+    # Record for a frame that was decoded but not sent to the model
+    height, width, channels = frame_shape
+    return {
+        "request_id": request_id,
+        "frame_id": frame_id,
+        "timestamp": frame_id / fps,
+        'shape': f"{height},{width},{channels}",
+        'box': [],
+        'confidence': [],
+        'class_id': [],
+        'class_name': [],
+        'detected': False
+    }
+
+
+def motion_thumbnail(frame):
+    small = cv2.resize(frame,
+                       MOTION_THUMBNAIL_SIZE,
+                       interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+
+
+def motion_score(thumbnail, reference_thumbnail):
+    # Mean absolute pixel difference between two motion thumbnails
+    return float(np.mean(np.abs(thumbnail - reference_thumbnail)))
+
+
+def iter_detections(video_source,
+                    request_id,
+                    models=None,
+                    frame_stride=1,
+                    motion_threshold=0,
+                    stats=None):
+    # Yield one {model name: detection record} dict per frame as soon as
+    # its batch is inferred. Each frame is decoded once and sent to every
+    # model in models (default MODEL_NAME). video_source is a local path
+    # or a URL the decoder can read directly. stats, if given, is filled
+    # with per-request frame counters.
+    models = models or [MODEL_NAME]
+    if stats is None:
+        stats = {}
+    stats.update({'frames': 0, 'inferred': 0, 'motion_skipped': 0})
+    try:
+        cap = open_capture(video_source)
+    except Exception as e:
+        raise DetectionError(f'Failed to open video for decoding: {str(e)}')
+    decoded_frames = decode_frames(cap)
+    try:
+        if not cap.isOpened():
+            raise DetectionError('Failed to open video for decoding')
+        fps = int(cap.get(cv2.CAP_PROP_FPS))
+        source_shape = getattr(cap, 'source_shape', None)
+        frame_count = 0
+        reference_thumbnail = None
+        last_records = None
+        with contextlib.ExitStack() as in_flight:
+            for model_name in models:
+                in_flight.enter_context(schedulers[model_name].request())
+            # Read stride-times larger batches so each predict call still
+            # sees about BATCH_SIZE frames
+            for frames in read_batches(decoded_frames,
+                                       BATCH_SIZE * frame_stride):
+                frame_ids = range(frame_count, frame_count + len(frames))
+
+                # Decide per frame: skipped by stride, reused by the
+                # motion gate, or sent to the model
+                actions = []
+                infer_frames = []
+                for frame_id, frame in zip(frame_ids, frames):
+                    if frame_id % frame_stride:
+                        actions.append('skip')
+                        continue
+                    if motion_threshold > 0:
+                        thumbnail = motion_thumbnail(frame)
+                        if reference_thumbnail is not None and motion_score(
+                                thumbnail,
+                                reference_thumbnail) < motion_threshold:
+                            actions.append('reuse')
+                            continue
+                        reference_thumbnail = thumbnail
+                    actions.append('infer')
+                    infer_frames.append(frame)
+
+                # Model inference, batched with other in-flight requests.
+                # Every model gets the batch before waiting on any of them.
+                try:
+                    futures = {
+                        model_name: schedulers[model_name].submit(infer_frames)
+                        for model_name in models
+                    }
+                    batch_results = {
+                        model_name: iter(future.result())
+                        for model_name, future in futures.items()
+                    }
+                except Exception as e:
+                    raise DetectionError(f'Model inference failed: {str(e)}')
+
+                # Split batch results back into per-frame records
+                try:
+                    records = []
+                    for frame_id, frame, action in zip(frame_ids, frames,
+                                                       actions):
+                        shape = source_shape or frame.shape
+                        if action == 'skip':
+                            records.append({
+                                model_name:
+                                build_skipped_frame_result(
+                                    request_id, frame_id, fps, shape)
+                                for model_name in models
+                            })
+                            continue
+                        if action == 'reuse':
+                            # Static frame: repeat the last inferred detections
+                            records.append({
+                                model_name:
+                                dict(record,
+                                     frame_id=frame_id,
+                                     timestamp=frame_id / fps,
+                                     motion_skipped=True)
+                                for model_name, record in last_records.items()
+                            })
+                            stats['motion_skipped'] += 1
+                            continue
+                        last_records = {
+                            model_name:
+                            build_frame_result(next(batch_results[model_name]),
+                                               request_id, frame_id, fps,
+                                               frame.shape, source_shape)
+                            for model_name in models
+                        }
+                        records.append(last_records)
+                        stats['inferred'] += 1
+                    frame_count += len(frames)
+                    stats['frames'] = frame_count
+                except Exception as e:
+                    raise DetectionError(
+                        f'Error processing detection results: {str(e)}')
+
+                yield from records
+    finally:
+        # Stop the decoder thread before releasing the capture
+        decoded_frames.close()
+        cap.release()
+
+
+def detection_cache_key(content_digest, options):
+    # Everything that changes the detection records for a segment; the
+    # requested models are part of options
+    return make_cache_key(content_digest, THRESHOLD, YOLO_BACKEND, YOLO_INT8,
+                          IMAGE_SIZE, PROXY_DECODE, options)
+
+
+def iter_cached_detections(video_source,
+                           request_id,
+                           cache_key=None,
+                           stats=None,
+                           **options):
+    # iter_detections behind the detection cache: a hit replays the stored
+    # records, a miss runs detection and stores the records once complete
+    if stats is None:
+        stats = {}
+    cache = detection_cache if cache_key else None
+
+    cached_entry = cache.get(cache_key) if cache else None
+    if cached_entry is not None:
+        stats.update({'frames': 0, 'inferred': 0, 'motion_skipped': 0})
+        for record in cache.iter_records(cached_entry):
+            for model_record in record.values():
+                model_record['request_id'] = request_id
+            stats['frames'] += 1
+            yield record
+        stats['cache_hit'] = True
+        return
+
+    writer = cache.writer(cache_key) if cache else None
+    try:
+        for record in iter_detections(video_source,
+                                      request_id,
+                                      stats=stats,
+                                      **options):
+            if writer:
+                writer.write(record)
+            yield record
+        if writer:
+            writer.commit()
+    finally:
+        # No-op after commit; drops partial entries on errors
+        if writer:
+            writer.abort()
+
+
+def log_detection_stats(request_id, stats):
+    if stats.get('cache_hit'):
+        logger.info(f"Request {request_id}: {stats['frames']} frames "
+                    f"served from the detection cache")
+        return
+    logger.info(
+        f"Request {request_id}: {stats['frames']} frames, "
+        f"{stats['inferred']} inferred, "
+        f"{stats['motion_skipped']} skipped by the motion gate")
+
+
+def format_frame(record, keyed):
+    # Per-frame output: keyed by model name when the request named its
+    # models, otherwise the default model's record alone
+    return record if keyed else record[MODEL_NAME]
+
+
+def format_detections(records, models, keyed):
+    # Whole-segment output: {model name: [records]} when the request named
+    # its models, otherwise the default model's list of records
+    if not keyed:
+        return [record[MODEL_NAME] for record in records]
+    return {
+        model_name: [record[model_name] for record in records]
+        for model_name in models
+    }
+
+
+def columnar_detections(records):
+    # One model's per-frame records as flat little-endian arrays instead
+    # of one dict per frame:
+    #   frame_ids (list), timestamps (f8), counts (i4, boxes per frame),
+    #   detected (bool, False for frames skipped by frame_stride),
+    #   shapes (table of [height, width, channels]) + shape_index (i4),
+    #   boxes (f8, x1 y1 x2 y2 per box), scores (f8), class_ids (i4),
+    #   class_names (table) + class_index (i4, per box)
+    shapes = {}
+    class_names = {}
+    frame_ids, timestamps, counts, detected, shape_index = [], [], [], [], []
+    boxes, scores, class_ids, class_index = [], [], [], []
+    for record in records:
+        frame_ids.append(record['frame_id'])
+        timestamps.append(record['timestamp'])
+        counts.append(len(record['box']))
+        detected.append(record.get('detected', True))
+        shape_index.append(shapes.setdefault(record['shape'], len(shapes)))
+        boxes.extend(record['box'])
+        scores.extend(record['confidence'])
+        class_ids.extend(record['class_id'])
+        class_index.extend(
+            class_names.setdefault(name, len(class_names))
+            for name in record['class_name'])
+    return {
+        'format': 'columns',
+        'request_id': records[0]['request_id'] if records else None,
+        'frame_ids': frame_ids,
+        'timestamps': np.asarray(timestamps, dtype='<f8').tobytes(),
+        'counts': np.asarray(counts, dtype='<i4').tobytes(),
+        'detected': np.asarray(detected, dtype=bool).tobytes(),
+        'shapes': [list(map(int, shape.split(','))) for shape in shapes],
+        'shape_index': np.asarray(shape_index, dtype='<i4').tobytes(),
+        'boxes': np.asarray(boxes, dtype='<f8').reshape(-1, 4).tobytes(),
+        'scores': np.asarray(scores, dtype='<f8').tobytes(),
+        'class_ids': np.asarray(class_ids, dtype='<i4').tobytes(),
+        'class_names': list(class_names),
+        'class_index': np.asarray(class_index, dtype='<i4').tobytes()
+    }
+
+
+def format_columnar(records, models, keyed):
+    # format_detections, with each model's records in columnar form
+    if not keyed:
+        return columnar_detections([record[MODEL_NAME] for record in records])
+    return {
+        model_name:
+        columnar_detections([record[model_name] for record in records])
+        for model_name in models
+    }
+
+
+def stream_detections(video_source,
+                      request_id,
+                      temp_input_video=None,
+                      cache_key=None,
+                      keyed=False,
+                      **options):
+    # NDJSON body for /detect: one JSON line per frame, or an error line
+    stats = {}
+    try:
+        for record in iter_cached_detections(video_source,
+                                             request_id,
+                                             cache_key=cache_key,
+                                             stats=stats,
+                                             **options):
+            yield json.dumps(format_frame(record, keyed)) + '\n'
+        log_detection_stats(request_id, stats)
+    except DetectionError as e:
+        logger.error(f"Streaming detection failed: {str(e)}")
+        yield json.dumps({'error': str(e)}) + '\n'
+    except Exception as e:
+        logger.error(f"Streaming detection failed: {str(e)}", exc_info=True)
+        yield json.dumps({'error':
+                          f'Error processing video: {str(e)}'}) + '\n'
+    finally:
+        # Clean up temporary files once the stream is finished
+        remove_scratch_file(temp_input_video)
+
+
+def parse_detect_options(request_data, defaults=None):
+    # Per-request detection options, falling back to defaults then env
+    defaults = defaults or {}
+    models = request_data.get('models', defaults.get('models', [MODEL_NAME]))
+    if isinstance(models, str):
+        models = [models]
+    if (not models or not isinstance(models, list)
+            or not all(isinstance(name, str) for name in models)):
+        raise ValueError('models must be a non-empty list of model names')
+    unknown = [name for name in models if name not in schedulers]
+    if unknown:
+        raise ValueError(f"Unknown models {unknown}; available models are "
+                         f"{AVAILABLE_MODELS}")
+    frame_stride = request_data.get('frame_stride',
+                                    defaults.get('frame_stride',
+                                                 FRAME_STRIDE))
+    # bool is an int subclass, but true is not a stride
+    if (isinstance(frame_stride, bool) or not isinstance(frame_stride, int)
+            or frame_stride < 1):
+        raise ValueError('frame_stride must be a positive integer')
+    motion_threshold = request_data.get(
+        'motion_threshold', defaults.get('motion_threshold',
+                                         MOTION_THRESHOLD))
+    if (isinstance(motion_threshold, bool)
+            or not isinstance(motion_threshold, (int, float))
+            or not math.isfinite(motion_threshold) or motion_threshold < 0):
+        raise ValueError('motion_threshold must be a non-negative number')
+    return {
+        'models': list(dict.fromkeys(models)),
+        'frame_stride': frame_stride,
+        'motion_threshold': float(motion_threshold)
+    }
+
+
+def wants_keyed_results(request_data, defaults=None):
+    # Requests that name their models get results keyed by model name
+    return 'models' in request_data or 'models' in (defaults or {})
+
+
+def fetch_segment(bucket_name, object_name):
+    # Stream video from bucket or download it to scratch space. Returns
+    # (video_source, temp_input_video, content_digest); temp_input_video
+    # is None in stream mode and must be removed by the caller otherwise.
+    if S3_INPUT_MODE == 'stream':
+        logging.info(
+            f"Streaming from bucket: {bucket_name}, object: {object_name}")
+        video_source, etag = presign_video(bucket_name, object_name)
+        return video_source, None, f"etag:{etag}"
+
+    logging.info(
+        f"Attempting to download from bucket: {bucket_name}, object: {object_name}"
+    )
+    temp_input_video = os.path.join(SCRATCH_DIR, f"{uuid.uuid4().hex}.mp4")
+    s3_client.download_file(bucket_name, object_name, temp_input_video)
+    if not os.path.exists(temp_input_video):
+        logger.error(
+            f"Failed to download video from S3: {bucket_name}/{object_name}")
+        raise DetectionError('Failed to download video from S3')
+    try:
+        content_digest = (file_digest(temp_input_video)
+                          if detection_cache else None)
+    except Exception:
+        remove_scratch_file(temp_input_video)
+        raise
+    return temp_input_video, temp_input_video, content_digest
+
+
+def detect_segment(bucket_name, object_name, request_id, options):
+    # Whole /detect flow for one segment, raising on any failure. Returns
+    # one {model name: record} dict per frame.
+    video_source, temp_input_video, content_digest = fetch_segment(
+        bucket_name, object_name)
+    try:
+        cache_key = (detection_cache_key(content_digest, options)
+                     if detection_cache else None)
+        stats = {}
+        detection_results = list(
+            iter_cached_detections(video_source,
+                                   request_id,
+                                   cache_key=cache_key,
+                                   stats=stats,
+                                   **options))
+        log_detection_stats(request_id, stats)
+        return detection_results
+    finally:
+        remove_scratch_file(temp_input_video)
+
 
 @app.route('/')
 def home():
     return "YOLOv8 service is running", 200
 
 
+@app.route('/ready')
+def ready():
+    # Readiness probe: healthy only once the model has been warmed up
+    if model_ready.is_set():
+        return "YOLOv8 model is ready", 200
+    if model_error:
+        return f"YOLOv8 model failed to load: {model_error}", 503
+    return "YOLOv8 model is loading", 503
+
+
+@app.route('/cache_stats')
+def cache_stats():
+    # Hit/miss counters of this worker process's detection cache
+    if detection_cache is None:
+        return flask.jsonify({'enabled': False}), 200
+    return flask.jsonify(dict(detection_cache.stats(), enabled=True)), 200
+
+
 @app.route('/detect', methods=['POST'])
 def detect():
     try:
@@ -37,24 +901,25 @@ def detect():
                     'No bucket or object name provided in YOLO service'
                 }), 400
 
+            not_ready = model_not_ready_response()
+            if not_ready:
+                return not_ready
+
             bucket_name = request_data.get('bucket_name')
             object_name = request_data.get('object_name')
             request_id = request_data.get('request_id')
-            temp_input_video = '/tmp/input.mp4'
+            try:
+                options = parse_detect_options(request_data)
+            except ValueError as e:
+                return flask.jsonify({'error': str(e)}), 400
+            keyed = wants_keyed_results(request_data)
 
-            # Download video from bucket
+            # Stream video from bucket or download it to scratch space
             try:
-                logging.info(
-                    f"Attempting to download from bucket: {bucket_name}, object: {object_name}"
-                )
-                s3_client.download_file(bucket_name, object_name,
-                                        temp_input_video)
-                if not os.path.exists(temp_input_video):
-                    logger.error(
-                        f"Failed to download video from S3: {bucket_name}/{object_name}"
-                    )
-                    return flask.jsonify(
-                        {'error': 'Failed to download video from S3'}), 500
+                video_source, temp_input_video, content_digest = \
+                    fetch_segment(bucket_name, object_name)
+            except DetectionError as e:
+                return flask.jsonify({'error': str(e)}), 500
             except boto3.exceptions.S3TransferFailedError as e:
                 logger.error(f"S3 transfer failed: {str(e)}")
                 return flask.jsonify(
@@ -68,78 +933,50 @@ def detect():
                     f'Unexpected error downloading from S3: {str(e)}'
                 }), 500
 
+            cache_key = (detection_cache_key(content_digest, options)
+                         if detection_cache else None)
+
+            # Stream one JSON line per frame when the caller asks for NDJSON
+            if flask.request.headers.get('Accept') == NDJSON_MIMETYPE:
+                return flask.Response(
+                    stream_detections(video_source, request_id,
+                                      temp_input_video, cache_key, keyed,
+                                      **options),
+                    mimetype=NDJSON_MIMETYPE)
+
+            stats = {}
             try:
                 # Process video
-                cap = cv2.VideoCapture(temp_input_video)
-
-                # Get video properties
-                width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                fps = int(cap.get(cv2.CAP_PROP_FPS))
-
-                # Initialize list to store detection results
-                detection_results = []
-
-                frame_count = 0
-                while cap.isOpened():
-                    ret, frame = cap.read()
-                    if not ret:
-                        break
-
-                    # Get the full shape of the frame
-                    height, width, channels = frame.shape
-
-                    # Model inference
-                    try:
-                        detection_results_frame = model.predict(
-                            source=frame, conf=float(THRESHOLD), task='detect')
-                        # print(f"det_results****: {detection_results_frame}")
-                    except Exception as e:
-                        return flask.jsonify(
-                            {'error':
-                             f'Model inference failed: {str(e)}'}), 500
-
-                    # Process results
-                    try:
-                        boxes = detection_results_frame[0].boxes.xyxy.tolist()
-                        confidences = detection_results_frame[
-                            0].boxes.conf.tolist()
-                        class_ids = detection_results_frame[
-                            0].boxes.cls.tolist()
-                        class_names = [
-                            detection_results_frame[0].names[int(id)]
-                            for id in class_ids
-                        ]
-
-                        # Append detection results for current frame
-                        detection_results.append({
-                            "request_id": request_id,
-                            "frame_id": frame_count,
-                            "timestamp": frame_count / fps,
-                            'shape': f"{height},{width},{channels}",
-                            'box': boxes,
-                            'confidence': confidences,
-                            'class_id': class_ids,
-                            'class_name': class_names
-                        })
-                    except Exception as e:
-                        return flask.jsonify({
-                            'error':
-                            f'Error processing detection results: {str(e)}'
-                        }), 500
-
-                    frame_count += 1
-
-                cap.release()
+                detection_results = list(
+                    iter_cached_detections(video_source,
+                                           request_id,
+                                           cache_key=cache_key,
+                                           stats=stats,
+                                           **options))
+            except DetectionError as e:
+                return flask.jsonify({'error': str(e)}), 500
             except Exception as e:
                 return flask.jsonify(
                     {'error': f'Error processing video: {str(e)}'}), 500
             finally:
                 # Clean up temporary files
-                if os.path.exists(temp_input_video):
-                    os.remove(temp_input_video)
+                remove_scratch_file(temp_input_video)
 
-            return flask.jsonify(detection_results)
+            log_detection_stats(request_id, stats)
+            if flask.request.headers.get('Accept') == MSGPACK_MIMETYPE:
+                response = flask.Response(msgpack.packb(
+                    format_columnar(detection_results, options['models'],
+                                    keyed)),
+                                          mimetype=MSGPACK_MIMETYPE)
+            else:
+                response = flask.jsonify(
+                    format_detections(detection_results, options['models'],
+                                      keyed))
+            response.headers['X-Motion-Skipped-Frames'] = str(
+                stats['motion_skipped'])
+            response.headers['X-Detection-Cache'] = ('hit' if stats.get(
+                'cache_hit') else 'miss')
+            return response
 
         except Exception as e:
             return flask.jsonify(
@@ -151,5 +988,72 @@ def detect():
             {'error': f'Unexpected error in YOLO service: {str(e)}'}), 500
 
 
+@app.route('/detect_batch', methods=['POST'])
+def detect_batch():
+    # Detect several segments in one call. Body is a list of
+    # {bucket_name, object_name, request_id} items, or {'segments': [...]}
+    # with shared detection options alongside. Segments run concurrently
+    # and share inference batches; failures are reported per segment.
+    try:
+        request_data = flask.request.get_json()
+        if isinstance(request_data, dict):
+            segments = request_data.get('segments')
+            defaults = request_data
+        else:
+            segments = request_data
+            defaults = {}
+        if not segments or not isinstance(segments, list):
+            return flask.jsonify(
+                {'error': 'No segments provided in YOLO service'}), 400
+
+        not_ready = model_not_ready_response()
+        if not_ready:
+            return not_ready
+
+        def run(segment):
+            result = {
+                'request_id': None,
+                'bucket_name': None,
+                'object_name': None
+            }
+            try:
+                # Malformed items fail on their own, never the whole batch
+                if not isinstance(segment, dict):
+                    raise ValueError('segment must be an object')
+                for key in result:
+                    result[key] = segment.get(key)
+                if not result['bucket_name'] or not result['object_name']:
+                    raise ValueError('No bucket or object name provided')
+                options = parse_detect_options(segment, defaults)
+                result['results'] = format_detections(
+                    detect_segment(result['bucket_name'],
+                                   result['object_name'],
+                                   result['request_id'], options),
+                    options['models'],
+                    wants_keyed_results(segment, defaults))
+                result['status'] = 'ok'
+            except Exception as e:
+                logger.error(
+                    f"Segment {result['object_name']} failed: {str(e)}",
+                    exc_info=not isinstance(e, (DetectionError, ValueError)))
+                result['status'] = 'error'
+                result['error'] = str(e)
+            return result
+
+        with ThreadPoolExecutor(
+                max_workers=min(DETECT_BATCH_WORKERS,
+                                len(segments))) as executor:
+            batch_results = list(executor.map(run, segments))
+
+        return flask.jsonify(batch_results), 200
+    except Exception as e:
+        logger.error(f"Unexpected error in YOLO service: {str(e)}",
+                     exc_info=True)
+        return flask.jsonify(
+            {'error': f'Unexpected error in YOLO service: {str(e)}'}), 500
+
+
 if __name__ == '__main__':
+    # Development server only - the container serves with gunicorn
+    start_models_in_background()
     app.run(host='0.0.0.0', port=5000)
@@ -130,6 +130,13 @@ export class EksStack extends cdk.Stack {
                 name: 'yolo',
                 image: props.ecrStack.yoloRepo.repositoryUri + `:${props.ecrStack.yoloVersion}`,
                 ports: [{ containerPort: 5000 }],
+                // Only route traffic once the service has finished warming up
+                readinessProbe: {
+                  httpGet: { path: '/ready', port: 5000 },
+                  initialDelaySeconds: 5,
+                  periodSeconds: 5,
+                  failureThreshold: 60,
+                },
               }],
             },
           },
@@ -180,6 +187,13 @@ export class EksStack extends cdk.Stack {
                 name: 'bytetrack',
                 image: props.ecrStack.bytetrackRepo.repositoryUri + `:${props.ecrStack.bytetrackVersion}`,
                 ports: [{ containerPort: 5001 }],
+                // Only route traffic once the service has finished warming up
+                readinessProbe: {
+                  httpGet: { path: '/ready', port: 5001 },
+                  initialDelaySeconds: 5,
+                  periodSeconds: 5,
+                  failureThreshold: 60,
+                },
               }],
             },
           },
@@ -42,26 +42,24 @@ export class ProcessingStack extends cdk.Stack {
         billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
       });
 
-      // Create Reset Bytetrack ID Lambda function
-      const resetBytetrackerId = new lambda.Function(this, 'ResetBytetrackerId', {
-        runtime: lambda.Runtime.PYTHON_3_10,
-        handler: 'index.handler',
-        vpc: props.vpc,
-        code: lambda.Code.fromAsset(path.join(__dirname, '../../app/resetBytetrackerId')),
-        timeout: cdk.Duration.seconds(30),
-        memorySize: 128, 
-        environment: {
-          BYTETRACK_SERVICE_ENDPOINT: `http://${props.bytetrackServiceAddress}`,
-        }
+      // Python modules shared between jobs (app/shared), as a layer under
+      // python/ so Lambda puts them on the import path
+      const sharedPythonLayer = new lambda.LayerVersion(this, 'SharedPythonLayer', {
+        code: lambda.Code.fromAsset(path.join(__dirname, '../../app/shared'), {
+          bundling: {
+            image: lambda.Runtime.PYTHON_3_10.bundlingImage,
+            command: ['bash', '-c', 'mkdir -p /asset-output/python && cp *.py /asset-output/python/'],
+          },
+        }),
+        compatibleRuntimes: [lambda.Runtime.PYTHON_3_10],
       });
 
-      
-      
       // Create Update DDB Lambda function
       const updateDynamoDbLambda = new lambda.Function(this, 'UpdateDynamoDbLambda', {
         runtime: lambda.Runtime.PYTHON_3_10,
         handler: 'index.handler',
         code: lambda.Code.fromAsset(path.join(__dirname, '../../app/updateDdb')),
+        layers: [sharedPythonLayer],
         environment: {
           OUTPUT_BUCKET: props.outputBucket.bucketName,
           DYNAMODB_TABLE_NAME: dynamoTable.tableName,
@@ -271,7 +269,12 @@ export class ProcessingStack extends cdk.Stack {
   
   // with AWS Batch ECS fargate
   const videoAnnotationContainerDef = new batch.EcsFargateContainerDefinition(this, 'VideoAnnotationContainerDef', {
-    image: ecs.ContainerImage.fromAsset(path.join(__dirname, '../../app/video-annotation')),
+    // Built from app/ to include app/shared next to the job's own code
+    image: ecs.ContainerImage.fromAsset(path.join(__dirname, '../../app'), {
+      file: 'video-annotation/Dockerfile',
+      ignoreMode: cdk.IgnoreMode.DOCKER,
+      exclude: ['*', '!video-annotation', '!shared'],
+    }),
     cpu: 4,
     memory: cdk.Size.gibibytes(8),
     environment: {
@@ -349,27 +352,6 @@ export class ProcessingStack extends cdk.Stack {
   //     container: videoMergeContainerDef,
   // });
   
-      const resetBytetrackerIdTask = new stepfunctions_tasks.LambdaInvoke(this, 'ResetBytetrackerIdTask', {
-        lambdaFunction: resetBytetrackerId,
-        retryOnServiceExceptions: true,
-      })
-
-      const parallelPreProcess = new stepfunctions.Parallel(this, 'ParallelPreProcess', {
-        resultPath: '$.parallelResults'
-      })
-        .branch(videoSplittingBatchJob)
-        .branch(resetBytetrackerIdTask);
-
-        const filterParallelResults = new stepfunctions.Pass(this, 'FilterParallelResults', {
-          parameters: {
-            'input_bucket_name.$': '$.input_bucket_name',
-            'output_bucket_name.$': '$.output_bucket_name',
-            'original_input_video.$': '$.original_input_video',
-            'request_id.$': '$.request_id',
-            'splitResult.$': '$.parallelResults[0].splitResult'
-          }
-        });
-  
       const processVideoChunks = new stepfunctions.Map(this, 'ProcessVideoChunks', {
         itemsPath: stepfunctions.JsonPath.stringAt('$.splitResult.segments'),
         itemSelector: {
@@ -448,8 +430,7 @@ export class ProcessingStack extends cdk.Stack {
         });
 
       const chain = initVariables
-          .next(parallelPreProcess)
-          .next(filterParallelResults)
+          .next(videoSplittingBatchJob)
           .next(processVideoChunks)
           .next(new stepfunctions.Pass(this, 'PrepareForPostProcess', {
             parameters: {